@@ -1,20 +1,24 @@
-from typing import List, Any
-from collections import OrderedDict
+from typing import List, Any, Optional
 from langchain_core.messages import SystemMessage
 from .state import ProjectState, Task
 import json
+import hashlib
 import os
 from dotenv import load_dotenv
-from .model_config import get_model
+from .model_config import get_routed_model
 from .retry_utils import invoke_with_retry
+from . import tracing
+from . import speculation
+from .bounded_cache import BoundedCache
+from . import templates
 
 load_dotenv()
 
 # Vacuna #005: Usar configuración centralizada de modelos Gemini por rol
-llm = get_model("architect")
+# (el router de model_config elige el tier según el tamaño de la spec)
 
-ARCHITECT_CACHE: OrderedDict[str, Any] = OrderedDict()
-CACHE_SIZE = 32
+# Caché acotada por bytes: guarda solo el texto de la respuesta, no el AIMessage
+ARCHITECT_CACHE = BoundedCache.from_env("architect", default_mb=4)
 
 ARCHITECT_SYSTEM_PROMPT = """
 You are 'El Arquitecto' (Agent 02), the Tech Lead for Aegis Forge.
@@ -40,6 +44,29 @@ Example Output:
 DO NOT include any other text in your response, ONLY the JSON object.
 """
 
+def _response_text(response: Any) -> str:
+    # Vaccine #009: Safe content extraction
+    if hasattr(response, 'content'):
+        return str(response.content).strip() if response.content else ""
+    return str(response).strip()
+
+
+def parse_plan(content: str) -> Optional[List[Task]]:
+    """Tasks of the Architect's JSON answer, or None if it cannot be parsed."""
+    # Extract JSON from response. content might be wrapped in ```json ... ```
+    if content.startswith("```json"):
+        content = content[7:-3].strip()
+    elif content.startswith("```"):
+        content = content[3:-3].strip()
+    try:
+        tasks = json.loads(content).get("tasks", [])
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(tasks, list) or not all(isinstance(task, dict) for task in tasks):
+        return None
+    return tasks
+
+
 def architect_agent(state: ProjectState) -> ProjectState:
     """
     Consumes the spec_document and generates the current_plan.
@@ -52,15 +79,21 @@ def architect_agent(state: ProjectState) -> ProjectState:
     else:
         spec = str(spec)
     
-    # Check if spec is empty (initial check)
+    # Check if spec is empty (initial check). Sin cambios: devolver `state`
+    # entero duplicaría `messages` por su reducer operator.add
     if not spec or not str(spec).strip():
-        return state 
+        return {}
 
     # Construct Raw Messages
     raw_messages = [
         SystemMessage(content=ARCHITECT_SYSTEM_PROMPT.strip()),
         SystemMessage(content=f"SPECIFICATION DOCUMENT:\n{spec.strip()}")
     ]
+
+    # Arranque en caliente: el plan de la plantilla más cercana sirve de base
+    template = templates.get_template(state.get("template_id"))
+    if template:
+        raw_messages.append(SystemMessage(content=templates.architect_seed(template)))
     
     # --- BLOQUE DE CORRECCIÓN (SANITIZACIÓN) ---
     # Filtramos mensajes para asegurar que NINGUNO esté vacío antes de llamar a Google
@@ -71,46 +104,45 @@ def architect_agent(state: ProjectState) -> ProjectState:
             
     # Si después de filtrar no queda nada, abortamos para evitar el crash
     if not model_messages:
-        return state
+        return {}
     # -------------------------------------------
 
-    # Generate safe cache key
-    cache_key = f"architect:{hash(spec[:200])}"  # Use hash of first 200 chars to avoid issues
+    # Plan especulativo ya calculado sobre la spec parcial (SPECULATIVE_PIPELINE)
+    speculative_plan = speculation.take_plan(state.get("request_id"), spec)
+    if speculative_plan is not None:
+        return {"current_plan": speculative_plan}
+
+    # Generate safe cache key: digest of the whole spec (a prefix would collide
+    # between a partial speculative spec and the final one)
+    cache_key = f"architect:{template['id'] if template else ''}:{hashlib.sha256(spec.encode('utf-8')).hexdigest()}"
 
-    if cache_key in ARCHITECT_CACHE:
-        ARCHITECT_CACHE.move_to_end(cache_key)
-        response = ARCHITECT_CACHE[cache_key]
+    content = ARCHITECT_CACHE.get(cache_key)
+    if content is not None:
+        tracing.add_event("cache.hit", cache="architect")
     else:
         # Usamos la lista filtrada 'model_messages'
-        response = invoke_with_retry(llm, model_messages)
-        ARCHITECT_CACHE[cache_key] = response
-        if len(ARCHITECT_CACHE) > CACHE_SIZE:
-            ARCHITECT_CACHE.popitem(last=False)
-    
-    try:
-        # Extract JSON from response. content might be wrapped in ```json ... ```
-        # Vaccine #009: Safe content extraction
-        if hasattr(response, 'content'):
-            content = str(response.content).strip() if response.content else ""
-        else:
-            content = str(response).strip()
-            
-        if content.startswith("```json"):
-            content = content[7:-3].strip()
-        elif content.startswith("```"):
-            content = content[3:-3].strip()
-            
-        plan_data = json.loads(content)
-        tasks = plan_data.get("tasks", [])
-        
-        # Ensure status is set
-        for task in tasks:
-            if "status" not in task:
-                task["status"] = "pending"
-                
-        # Return only the fields we're updating
-        return {"current_plan": tasks}
-    except Exception as e:
-        print(f"Error parsing architect plan: {e}")
+        llm = get_routed_model("architect", model_messages)
+        content = _response_text(invoke_with_retry(llm, model_messages))
+        if parse_plan(content) is None:
+            # Un plan ilegible de un tier barato se repite en el tier estándar
+            # en vez de convertirse en un plan vacío
+            escalated = get_routed_model("architect", model_messages, min_tier="standard")
+            if escalated is not llm:
+                tracing.add_event("model.escalate", role="architect", tier="standard")
+                content = _response_text(invoke_with_retry(escalated, model_messages))
+        ARCHITECT_CACHE.set(cache_key, content)
+
+    with tracing.span("architect.parse"):
+        tasks = parse_plan(content)
+    if tasks is None:
+        print(f"Error parsing architect plan: {content[:200]!r}")
         # Return empty plan on error
-        return {"current_plan": []}
\ No newline at end of file
+        return {"current_plan": []}
+
+    # Ensure status is set
+    for task in tasks:
+        if "status" not in task:
+            task["status"] = "pending"
+
+    # Return only the fields we're updating
+    return {"current_plan": tasks}
\ No newline at end of file
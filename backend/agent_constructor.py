@@ -11,28 +11,75 @@ Modelo: DeepSeek-Coder-V2 o CodeLlama (Local/Privado)
 """
 
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 import os
 from dotenv import load_dotenv
-from .model_config import get_model
+from .model_config import get_routed_model
 from .retry_utils import invoke_with_retry
+from . import tracing
+from . import speculation
+from . import templates
 
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
+def parse_constructor_output(content: str) -> Dict[str, Any]:
+    """
+    Extrae el JSON de archivos de la respuesta cruda del Constructor.
+
+    Tolera bloques de markdown y texto alrededor del objeto; si no hay JSON
+    válido devuelve una estructura vacía con warnings.
+    """
+    try:
+        # Parsear JSON de la respuesta
+        response_text = content.strip()
+        
+        # Intento 1: Eliminar bloques de markdown si existen
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text: # Por si acaso pone solo ```
+            response_text = response_text.split("```")[1].split("```")[0].strip()
+        
+        # Intento 2: Buscar límites del objeto JSON
+        json_start = response_text.find('{')
+        json_end = response_text.rfind('}') + 1
+        
+        if json_start != -1 and json_end > json_start:
+            json_str = response_text[json_start:json_end]
+            # Intentamos parsear con strict=False para permitir caracteres de control dentro de strings
+            # (común en salidas de LLMs que ponen saltos de línea literales en el código)
+            result = json.loads(json_str, strict=False)
+        else:
+            # Si no hay JSON válido, devolver estructura por defecto
+            result = {
+                "file_structure": {},
+                "warnings": ["No valid JSON structure found in response"],
+                "next_step": "Reintentar con prompt mejorado"
+            }
+        
+        # Agregar info de depuración
+        result["constructor_message"] = content
+        
+        return result
+        
+    except Exception as e:
+        return {
+            "file_structure": {},
+            "warnings": [f"JSON Parse Error: {str(e)}", "Raw response snippet:", content[:1000]],
+            "next_step": "Reintentar con formato de salida mejorado",
+            "constructor_message": content
+        }
+
 class ConstructorAgent:
     """El Constructor: Genera código de producción desde planes técnicos"""
     
-    def __init__(self):
-        # Vacuna #005: Usar configuración centralizada (Gemini por rol)
-        self.model = get_model("constructor")
-    
     def generate_code(
         self, 
         plan: str, 
         spec: str, 
         vaccines: List[str],
-        messages: List[BaseMessage]
+        messages: List[BaseMessage],
+        template_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Genera código producción desde un plan técnico.
@@ -42,6 +89,7 @@ class ConstructorAgent:
             spec: Especificación del Visionario
             vaccines: Lista de "reglas negativas" del Escriba (ej: "No uses fs module en Next.js edge")
             messages: Historial de mensajes
+            template_id: Plantilla base; si existe solo se genera el delta sobre sus ficheros
             
         Returns:
             {
@@ -59,6 +107,10 @@ class ConstructorAgent:
             for vaccine in vaccines:
                 vaccine_context += f"⚠️ {vaccine}\n"
         
+        # Arranque en caliente: ficheros base de la plantilla (ver templates.py)
+        template = templates.get_template(template_id)
+        template_context = templates.constructor_seed(template) if template else ""
+        
         constructor_prompt = f"""
         Eres El Constructor, un Senior Developer experto en arquitectura limpia y seguridad.
         
@@ -72,6 +124,8 @@ class ConstructorAgent:
         
         {vaccine_context}
         
+        {template_context}
+        
         ## INSTRUCCIONES CRÍTICAS:
         1. Genera código modular, tipado y bien documentado
         2. Respeta las restricciones de seguridad (Vacunas) - son críticas
@@ -100,48 +154,23 @@ class ConstructorAgent:
             HumanMessage(content=constructor_prompt)
         ]
         
-        # Generar respuesta
-        response = invoke_with_retry(self.model, messages_for_model)
+        # Vacuna #005: Usar configuración centralizada; el router elige el tier
+        # según el tamaño del prompt y el número de tareas del plan
+        model = get_routed_model("constructor", messages_for_model, plan=plan)
         
-        try:
-            # Parsear JSON de la respuesta
-            response_text = response.content.strip()
-            
-            # Intento 1: Eliminar bloques de markdown si existen
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0].strip()
-            elif "```" in response_text: # Por si acaso pone solo ```
-                response_text = response_text.split("```")[1].split("```")[0].strip()
-            
-            # Intento 2: Buscar límites del objeto JSON
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            
-            if json_start != -1 and json_end > json_start:
-                json_str = response_text[json_start:json_end]
-                # Intentamos parsear con strict=False para permitir caracteres de control dentro de strings
-                # (común en salidas de LLMs que ponen saltos de línea literales en el código)
-                result = json.loads(json_str, strict=False)
-            else:
-                # Si no hay JSON válido, devolver estructura por defecto
-                result = {
-                    "file_structure": {},
-                    "warnings": ["No valid JSON structure found in response"],
-                    "next_step": "Reintentar con prompt mejorado"
-                }
-            
-            # Agregar info de depuración
-            result["constructor_message"] = response.content
-            
-            return result
-            
-        except Exception as e:
-            return {
-                "file_structure": {},
-                "warnings": [f"JSON Parse Error: {str(e)}", "Raw response snippet:", response.content[:1000]],
-                "next_step": "Reintentar con formato de salida mejorado",
-                "constructor_message": response.content
-            }
+        # Generar respuesta
+        response = invoke_with_retry(model, messages_for_model)
+        
+        with tracing.span("constructor.parse", response_chars=len(response.content)):
+            result = parse_constructor_output(response.content)
+        
+        if template:
+            # El modelo devolvió el delta y las rutas de la plantilla que conserva
+            kept = result.get("kept_files")
+            result["file_structure"] = templates.merge_files(
+                template, result.get("file_structure", {}), kept if isinstance(kept, list) else None
+            )
+        return result
 
 def constructor_node(state: dict) -> dict:
     """
@@ -158,14 +187,18 @@ def constructor_node(state: dict) -> dict:
         - build_status: "clean", "vulnerable", "broken"
     """
     
-    constructor = ConstructorAgent()
+    # Código especulativo generado con este mismo plan (SPECULATIVE_PIPELINE)
+    result = speculation.take_code(state.get("request_id"), state.get("current_plan", ""))
     
-    result = constructor.generate_code(
-        plan=state.get("current_plan", ""),
-        spec=state.get("spec_document", ""),
-        vaccines=state.get("security_vaccines", []),
-        messages=state.get("messages", [])
-    )
+    if result is None:
+        constructor = ConstructorAgent()
+        result = constructor.generate_code(
+            plan=state.get("current_plan", ""),
+            spec=state.get("spec_document", ""),
+            vaccines=state.get("security_vaccines", []),
+            messages=state.get("messages", []),
+            template_id=state.get("template_id")
+        )
     
     # Evaluar si hay warnings críticos
     build_status = "clean"
@@ -175,9 +208,8 @@ def constructor_node(state: dict) -> dict:
         elif any("error" in w.lower() for w in result["warnings"]):
             build_status = "broken"
     
-    # Agregar mensaje de respuesta
-    state["messages"].append(
-        AIMessage(content=f"""
+    # Mensaje de respuesta: solo el nuevo, el reducer operator.add lo añade al historial
+    message = AIMessage(content=f"""
         🏗️ **El Constructor ha generado código**
         
         Archivos generados: {len(result.get('file_structure', {}))}
@@ -187,10 +219,9 @@ def constructor_node(state: dict) -> dict:
         
         Próximo paso: {result.get('next_step', '')}
         """)
-    )
-    
+
     return {
         "code_diffs": list(result.get("file_structure", {}).items()),
         "build_status": build_status,
-        "messages": state["messages"]
+        "messages": [message]
     }
@@ -1,21 +1,26 @@
 from typing import List, Any
-from collections import OrderedDict
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
 from .state import ProjectState
 import os
+import logging
 from dotenv import load_dotenv
-from .model_config import get_model
+from .model_config import get_routed_model
 from .retry_utils import invoke_with_retry
+from . import tracing
+from . import speculation
+from .cassette import invoke_with_cassette
+from .bounded_cache import BoundedCache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Para desarrollo local, asegúrate de tener GOOGLE_API_KEY en .env
-# Vacuna #005: Centralizar configuración de modelos (Gemini por rol)
-llm = get_model("visionary")
+# Vacuna #005: Centralizar configuración de modelos (Gemini por rol).
+# El modelo concreto se elige por llamada con el router de model_config.
 
-# Simple LRU cache to reduce duplicate calls and quota usage
-VISIONARY_CACHE: OrderedDict[str, Any] = OrderedDict()
-CACHE_SIZE = 32
+# Caché acotada por bytes: guarda solo el texto de la spec, no el AIMessage
+VISIONARY_CACHE = BoundedCache.from_env("visionary", default_mb=8)
 
 VISIONARY_SYSTEM_PROMPT = """
 You are 'El Visionario' (Agent 01), the Product Manager for Aegis Forge.
@@ -35,6 +40,7 @@ def visionary_agent(state: ProjectState) -> ProjectState:
     Analyzes user messages and generates/updates the spec_document.
     """
     messages = state.get("messages", [])
+    request_id = state.get("request_id", "")
     
     # Simple logic: use the last human message or all messages to build the spec
     # In a more advanced version, this would be a multi-turn conversation
@@ -54,14 +60,25 @@ def visionary_agent(state: ProjectState) -> ProjectState:
         # Fallback to simple hash if join fails
         cache_key = str(hash(str(model_messages)))
 
-    if cache_key in VISIONARY_CACHE:
-        VISIONARY_CACHE.move_to_end(cache_key)
-        response = VISIONARY_CACHE[cache_key]
+    cached_spec = VISIONARY_CACHE.get(cache_key)
+    if cached_spec is not None:
+        response = AIMessage(content=cached_spec)
+        tracing.add_event("cache.hit", cache="visionary")
     else:
-        response = invoke_with_retry(llm, model_messages)
-        VISIONARY_CACHE[cache_key] = response
-        if len(VISIONARY_CACHE) > CACHE_SIZE:
-            VISIONARY_CACHE.popitem(last=False)
+        llm = get_routed_model("visionary", model_messages)
+        if speculation.SPECULATIVE_PIPELINE:
+            # Streaming + arranque especulativo del Arquitecto (ver speculation.py)
+            request_id = request_id or tracing.new_request_id()
+            try:
+                response = invoke_with_cassette(
+                    llm, model_messages,
+                    lambda m, msgs: speculation.stream_spec(m, msgs, state, request_id),
+                )
+            except Exception as e:
+                logger.warning("Speculative streaming failed, falling back to invoke: %s", e)
+                response = invoke_with_retry(llm, model_messages)
+        else:
+            response = invoke_with_retry(llm, model_messages)
     
     # Update the spec document
     # Vaccine #009: Ensure content is string, not list (Gemini can return lists)
@@ -71,9 +88,15 @@ def visionary_agent(state: ProjectState) -> ProjectState:
         spec_content = "\n".join([str(item) for item in raw_content])
     else:
         spec_content = str(raw_content)
+    if cached_spec is None:
+        VISIONARY_CACHE.set(cache_key, spec_content)
 
     # Return state updates - operator.add will handle message concatenation
-    return {
+    updates = {
         "spec_document": spec_content, # Ensure this is always a string
         "messages": [response]
     }
+    if request_id and request_id != state.get("request_id"):
+        # La especulación se indexa por request_id: los nodos siguientes lo necesitan
+        updates["request_id"] = request_id
+    return updates
@@ -0,0 +1,156 @@
+"""
+Generación por lotes (`POST /chat/batch`).
+
+Deduplica prompts idénticos, sirve los cacheados al instante y ejecuta el
+resto con concurrencia acotada bajo el presupuesto global de tokens. Emite
+NDJSON: una línea por prompt (en orden de finalización) y una línea final con
+el resumen.
+
+Un lote no es más barato que /chat:
+- cada prompt único sin caché consume una ejecución del límite por cliente de
+  /chat (`charge_run`); los que lo superan terminan con 429;
+- BATCH_CONCURRENCY es un tope del proceso, compartido por todos los lotes en
+  curso, no por petición.
+
+Si el cliente se desconecta, las tareas que aún esperan turno o presupuesto se
+cancelan y las que ya ejecutan el grafo se detienen antes de su siguiente nodo
+(ver chat_pipeline.py).
+
+Variables de entorno:
+- BATCH_MAX_PROMPTS=50
+- BATCH_CONCURRENCY=4
+- BATCH_BUDGET_WAIT_S=120   espera máxima por presupuesto de tokens
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+from collections import Counter, OrderedDict
+from typing import AsyncIterator, Callable, List, Optional
+
+from fastapi import HTTPException
+
+from . import responses
+from . import llm_budget
+from . import shared_limits
+from .chat_pipeline import CHAT_CACHE, ChatCancelled, chat_error, result_id, run_chat_graph
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_BUDGET_WAIT_S = float(os.getenv("BATCH_BUDGET_WAIT_S", "120"))
+
+# Un semáforo por event loop (uno por worker de Uvicorn): tope de grafos de lote en curso
+_SEMAPHORES: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _process_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = _SEMAPHORES[loop] = asyncio.Semaphore(BATCH_CONCURRENCY)
+    return semaphore
+
+
+async def wait_for_token_budget(budget: shared_limits.TokenBudget, message: str) -> Optional[llm_budget.Reservation]:
+    """Espera (hasta BATCH_BUDGET_WAIT_S) a que el presupuesto de tokens admita el mensaje."""
+    deadline = time.monotonic() + BATCH_BUDGET_WAIT_S
+    while True:
+        # El almacén es bloqueante (SQLite/Redis): fuera del event loop
+        reservation, retry_after = await asyncio.to_thread(
+            llm_budget.reserve, llm_budget.estimate_request_tokens(message), budget)
+        if reservation is not None:
+            return reservation
+        if time.monotonic() + retry_after > deadline:
+            return None
+        await asyncio.sleep(retry_after)
+
+
+async def batch_events(prompts: List[str], concurrency: int, request_id: str,
+                       budget: shared_limits.TokenBudget, charge_run: Callable[[], bool]) -> AsyncIterator[bytes]:
+    """
+    Genera las líneas NDJSON de /chat/batch a medida que termina cada prompt.
+
+    `charge_run` consume una ejecución del límite de /chat del cliente y
+    devuelve False si ya no le quedan.
+    """
+    counts: Counter = Counter()
+
+    def line(index: int, first: int, prompt: str, status_name: str,
+             result: Optional[bytes] = None, **fields) -> bytes:
+        counts[status_name] += 1
+        item = {"index": index, "prompt": prompt, "status": status_name, **fields}
+        if index != first:
+            item["duplicate_of"] = first
+        body = responses.dumps(item)
+        if result is not None:
+            # El resultado ya es JSON (de la caché): se inserta sin decodificarlo
+            body = body[:-1] + b',"result":' + result + b"}"
+        return body + b"\n"
+
+    # Deduplicar: cada prompt único se ejecuta una sola vez
+    groups: "OrderedDict[str, List[int]]" = OrderedDict()
+    for index, prompt in enumerate(prompts):
+        key = prompt.strip()
+        if not key:
+            yield line(index, index, prompt, "error", status_code=400, error="El mensaje no puede estar vacío.")
+            continue
+        groups.setdefault(key, []).append(index)
+
+    pending = []
+    for key, indices in groups.items():
+        cached = CHAT_CACHE.get(result_id(key))
+        if cached is not None:
+            result = responses.EncodedJSON.unpack(cached).json_bytes()
+            for index in indices:
+                yield line(index, indices[0], key, "cached", result=result)
+        else:
+            pending.append(key)
+
+    # Tope propio de la petición (max_concurrency) dentro del tope del proceso
+    semaphore = asyncio.Semaphore(concurrency)
+    process_semaphore = _process_semaphore()
+    cancelled = threading.Event()
+
+    async def run_one(n: int, key: str):
+        if not await asyncio.to_thread(charge_run):
+            return key, None, HTTPException(status_code=429, detail="Rate limit exceeded. Please retry shortly.")
+        async with semaphore, process_semaphore:
+            reservation = await wait_for_token_budget(budget, key)
+            if reservation is None:
+                return key, None, HTTPException(status_code=429, detail="Presupuesto de tokens de IA agotado.")
+            try:
+                result = await asyncio.to_thread(llm_budget.run_charged, reservation,
+                                                 run_chat_graph, key, f"{request_id}:{n}", None, cancelled)
+                return key, await asyncio.to_thread(responses.encode_json, result), None
+            except ChatCancelled:
+                raise asyncio.CancelledError()
+            except Exception as e:
+                logger.error(f"Error en /chat/batch: {str(e)}")
+                return key, None, chat_error(e)
+
+    tasks = [asyncio.create_task(run_one(n, key)) for n, key in enumerate(pending)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, encoded, error = await next_done
+            indices = groups[key]
+            if error is None:
+                CHAT_CACHE.set(result_id(key), encoded.pack())
+                result = encoded.json_bytes()
+            for index in indices:
+                if error is None:
+                    yield line(index, indices[0], key, "ok", result=result)
+                else:
+                    yield line(index, indices[0], key, "error", status_code=error.status_code, error=error.detail)
+    finally:
+        # Cliente desconectado: las tareas en espera se cancelan y los grafos
+        # en marcha paran antes de su siguiente nodo
+        cancelled.set()
+        for task in tasks:
+            task.cancel()
+
+    yield responses.dumps({"summary": {"total": len(prompts), "unique": len(groups), **counts}}) + b"\n"
@@ -0,0 +1,238 @@
+"""
+Generador de carga asyncio para /chat, /refine y /export.
+
+Lanza peticiones en lazo abierto (llegadas Poisson o constantes) contra la app
+ASGI en proceso o contra un servidor por HTTP, y reporta throughput, tasa de
+errores y p50/p95/p99 por endpoint. En proceso usa el proveedor falso
+(LLM_PROVIDER=fake) y desactiva el rate limit, así que es reproducible en un
+portátil.
+
+Uso:
+    python -m backend.benchmarks.loadtest --rate 2,4,8,16 --duration 20
+    python -m backend.benchmarks.loadtest --url http://localhost:8000 --rate 5 --mix chat=1
+    FAKE_LLM_LATENCY_MS=800 python -m backend.benchmarks.loadtest --mix chat=6,refine=2,export=2 --output load.json
+"""
+
+import os
+
+# Debe fijarse antes de importar los agentes: instancian su modelo al importarse
+os.environ.setdefault("LLM_PROVIDER", "fake")
+
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from .stats import summarize
+
+ENDPOINTS = ("chat", "refine", "export")
+
+
+class PayloadFactory:
+    """Deterministic request payloads for each endpoint."""
+
+    def __init__(self, rng: random.Random, unique_ratio: float, export_files: int,
+                 export_file_bytes: int, refine_files: int):
+        self.rng = rng
+        self.unique_ratio = unique_ratio
+        self.export_files = {
+            f"src/pkg_{i // 50}/file_{i}.ts": ("x" * 63 + "\n") * max(1, export_file_bytes // 64)
+            for i in range(export_files)
+        }
+        self.refine_files = {f"src/component_{i}.tsx": "export const C = () => null;\n" * 20 for i in range(refine_files)}
+        self._counter = 0
+
+    def build(self, endpoint: str) -> Tuple[str, Dict[str, Any]]:
+        self._counter += 1
+        if endpoint == "chat":
+            # Una fracción de prompts se repite para ejercitar la caché de /chat
+            if self.rng.random() < self.unique_ratio:
+                message = f"Proyecto de carga {self._counter}: app de tareas con auth"
+            else:
+                message = f"Proyecto de carga repetido {self.rng.randint(1, 5)}"
+            return "/chat", {"message": message}
+        if endpoint == "refine":
+            return "/refine", {"instruction": f"Añade validación #{self._counter}", "current_files": self.refine_files}
+        return "/export", {"files": self.export_files}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in mix: {name}")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("Empty payload mix")
+    return weights
+
+
+async def run_stage(client: httpx.AsyncClient, rate: float, duration: float, mix: Dict[str, float],
+                    payloads: PayloadFactory, rng: random.Random, poisson: bool,
+                    max_in_flight: int) -> Dict[str, Any]:
+    """Drive `rate` requests/s for `duration` seconds and summarize the outcome."""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, Counter] = defaultdict(Counter)
+    sent: Counter = Counter()
+    dropped: Counter = Counter()
+    in_flight = set()
+    names, weights = list(mix), list(mix.values())
+
+    async def one(endpoint: str, path: str, body: Dict[str, Any]):
+        start = time.perf_counter()
+        try:
+            response = await client.post(path, json=body)
+            await response.aread()
+            if response.status_code >= 400:
+                errors[endpoint][str(response.status_code)] += 1
+                return
+        except Exception as e:
+            errors[endpoint][type(e).__name__] += 1
+            return
+        latencies[endpoint].append(time.perf_counter() - start)
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    next_at = start
+    while next_at - start < duration:
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        endpoint = rng.choices(names, weights)[0]
+        if len(in_flight) >= max_in_flight:
+            # Lazo abierto: si el cliente está saturado la petición se pierde, no se retrasa
+            dropped[endpoint] += 1
+        else:
+            path, body = payloads.build(endpoint)
+            sent[endpoint] += 1
+            task = asyncio.create_task(one(endpoint, path, body))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_at += rng.expovariate(rate) if poisson else 1 / rate
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    elapsed = loop.time() - start
+
+    per_endpoint = {}
+    for endpoint in names:
+        n_errors = sum(errors[endpoint].values())
+        stats = summarize(latencies[endpoint])
+        stats.pop("ops_per_sec", None)
+        per_endpoint[endpoint] = {
+            "sent": sent[endpoint],
+            "ok": len(latencies[endpoint]),
+            "errors": dict(errors[endpoint]),
+            "error_rate": round(n_errors / sent[endpoint], 4) if sent[endpoint] else 0.0,
+            "dropped": dropped[endpoint],
+            "throughput_rps": round(len(latencies[endpoint]) / elapsed, 2) if elapsed else 0.0,
+            **stats,
+        }
+
+    all_latencies = [x for values in latencies.values() for x in values]
+    total_sent = sum(sent.values())
+    total_errors = sum(sum(c.values()) for c in errors.values())
+    overall = summarize(all_latencies)
+    overall.pop("ops_per_sec", None)
+    return {
+        "target_rps": rate,
+        "elapsed_s": round(elapsed, 3),
+        "sent": total_sent,
+        "dropped": sum(dropped.values()),
+        "error_rate": round(total_errors / total_sent, 4) if total_sent else 0.0,
+        "throughput_rps": round(len(all_latencies) / elapsed, 2) if elapsed else 0.0,
+        "overall": overall,
+        "endpoints": per_endpoint,
+    }
+
+
+def _client(url: Optional[str], keep_rate_limits: bool) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=None, limits=limits)
+
+    from .. import main
+    if not keep_rate_limits:
+        main.limiter.enabled = False
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest", timeout=None)
+
+
+def _print_stage(stage: Dict[str, Any]):
+    print(f"\n== target {stage['target_rps']} req/s | achieved {stage['throughput_rps']} req/s | "
+          f"errors {stage['error_rate']:.1%} | dropped {stage['dropped']}")
+    print(f"{'endpoint':<10} {'sent':>6} {'ok':>6} {'err%':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    rows = list(stage["endpoints"].items()) + [("all", {**stage["overall"], "sent": stage["sent"],
+                                                         "ok": stage["overall"].get("iterations", 0),
+                                                         "error_rate": stage["error_rate"]})]
+    for name, s in rows:
+        print(f"{name:<10} {s['sent']:>6} {s['ok']:>6} {s['error_rate']:>7.1%} "
+              f"{s.get('p50_ms', 0):>10.1f} {s.get('p95_ms', 0):>10.1f} {s.get('p99_ms', 0):>10.1f}")
+
+
+async def run(args) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    payloads = PayloadFactory(rng, args.unique_ratio, args.export_files, args.export_file_bytes, args.refine_files)
+    stages = []
+    async with _client(args.url, args.keep_rate_limits) as client:
+        for rate in [float(r) for r in args.rate.split(",") if r.strip()]:
+            stage = await run_stage(client, rate, args.duration, mix, payloads, rng,
+                                    poisson=args.arrival == "poisson", max_in_flight=args.max_in_flight)
+            _print_stage(stage)
+            stages.append(stage)
+    return {
+        "config": {
+            "target": args.url or "in-process",
+            "mix": mix,
+            "duration_s": args.duration,
+            "arrival": args.arrival,
+            "export_files": args.export_files,
+            "export_file_bytes": args.export_file_bytes,
+            "provider": os.getenv("LLM_PROVIDER"),
+            "fake_llm": {k: v for k, v in os.environ.items() if k.startswith("FAKE_LLM_")},
+        },
+        "stages": stages,
+    }
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Aegis Forge load test (latency percentiles per endpoint)")
+    parser.add_argument("--url", help="Base URL of a running server (default: in-process ASGI app)")
+    parser.add_argument("--rate", default="2", help="Arrival rate in req/s; comma-separated list sweeps several stages")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per stage")
+    parser.add_argument("--arrival", choices=("poisson", "constant"), default="poisson")
+    parser.add_argument("--mix", default="chat=6,refine=2,export=2", help="Endpoint weights, e.g. chat=6,refine=2,export=2")
+    parser.add_argument("--unique-ratio", type=float, default=0.8, help="Fraction of /chat prompts that are unique")
+    parser.add_argument("--export-files", type=int, default=200, help="Files per /export request")
+    parser.add_argument("--export-file-bytes", type=int, default=4096)
+    parser.add_argument("--refine-files", type=int, default=10, help="Files sent as context to /refine")
+    parser.add_argument("--max-in-flight", type=int, default=512)
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Do not disable slowapi in-process")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
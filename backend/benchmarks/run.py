@@ -0,0 +1,255 @@
+"""
+Suite de benchmarks offline (sin red ni cuota).
+
+Ejecuta el grafo y los endpoints contra el proveedor falso (LLM_PROVIDER=fake)
+y escribe un informe JSON comparable entre commits.
+
+Uso:
+    python -m backend.benchmarks.run --output bench_base.json
+    python -m backend.benchmarks.run --compare bench_base.json --threshold 0.15 --fail-on-regression
+
+La latencia simulada del proveedor se controla con FAKE_LLM_* (ver fake_llm.py);
+por defecto es 0 para medir solo el coste propio del backend.
+"""
+
+import os
+
+# Debe fijarse antes de importar los agentes: instancian su modelo al importarse
+os.environ.setdefault("LLM_PROVIDER", "fake")
+
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import httpx
+from langchain_core.messages import HumanMessage
+
+from .. import main
+from .. import fake_llm
+from ..graph import graph
+from ..agent_visionary import VISIONARY_CACHE
+from ..agent_architect import ARCHITECT_CACHE
+from ..agent_constructor import parse_constructor_output
+from .stats import summarize
+
+logger = logging.getLogger(__name__)
+
+
+def _clear_caches():
+    VISIONARY_CACHE.clear()
+    ARCHITECT_CACHE.clear()
+    main.CHAT_CACHE.clear()
+
+
+def _initial_state(message: str) -> Dict[str, Any]:
+    return {
+        "messages": [HumanMessage(content=message)],
+        "spec_document": "",
+        "current_plan": [],
+        "code_diffs": [],
+        "retry_count": 0,
+        "build_status": "clean",
+    }
+
+
+def _asgi_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=None)
+
+
+def measure(fn: Callable[[int], Any], iterations: int, warmup: int = 1) -> Dict[str, float]:
+    """Time `fn(i)` over `iterations` runs after `warmup` untimed runs."""
+    for i in range(warmup):
+        fn(-1 - i)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def measure_async(fn: Callable[[int], Any], iterations: int, warmup: int = 1) -> Dict[str, float]:
+    for i in range(warmup):
+        await fn(-1 - i)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await fn(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+# --- Benchmarks ---
+
+def bench_graph_cold(iterations: int) -> Dict[str, float]:
+    def run(i):
+        _clear_caches()
+        graph.invoke(_initial_state(f"Aplicación de tareas número {i}"))
+    return measure(run, iterations)
+
+
+def bench_graph_cached_stages(iterations: int) -> Dict[str, float]:
+    # Visionario y Arquitecto salen de caché; solo el Constructor llama al modelo
+    _clear_caches()
+    return measure(lambda i: graph.invoke(_initial_state("Aplicación de tareas cacheada")), iterations)
+
+
+def _constructor_output(n_files: int, fenced: bool) -> str:
+    files = {f"src/file_{i}.ts": f"export const value{i} = {i};\n" * 80 for i in range(n_files)}
+    body = json.dumps({"file_structure": files, "warnings": [], "next_step": "ok"})
+    return f"Aquí está el código:\n```json\n{body}\n```" if fenced else body
+
+
+def bench_constructor_parse(iterations: int, n_files: int, fenced: bool) -> Dict[str, float]:
+    content = _constructor_output(n_files, fenced)
+    return measure(lambda i: parse_constructor_output(content), iterations)
+
+
+async def bench_chat_cache_hit(iterations: int) -> Dict[str, float]:
+    _clear_caches()
+    async with _asgi_client() as client:
+        payload = {"message": "Aplicación de tareas para caché de /chat"}
+        await client.post("/chat", json=payload)
+        return await measure_async(lambda i: client.post("/chat", json=payload), iterations)
+
+
+async def bench_export_zip(iterations: int, n_files: int, file_bytes: int = 4096) -> Dict[str, float]:
+    files = {f"src/pkg_{i // 50}/file_{i}.ts": ("x" * 63 + "\n") * (file_bytes // 64) for i in range(n_files)}
+    async with _asgi_client() as client:
+        async def run(i):
+            response = await client.post("/export", json={"files": files})
+            response.raise_for_status()
+        return await measure_async(run, iterations)
+
+
+async def bench_chat_concurrent(iterations: int, concurrency: int) -> Dict[str, float]:
+    """Per-request latency of `concurrency` simultaneous uncached /chat calls."""
+    _clear_caches()
+    latencies: List[float] = []
+    async with _asgi_client() as client:
+        async def one(batch: int, n: int):
+            start = time.perf_counter()
+            response = await client.post("/chat", json={"message": f"Proyecto concurrente {batch}-{n}"})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+        wall_start = time.perf_counter()
+        for batch in range(iterations):
+            await asyncio.gather(*(one(batch, n) for n in range(concurrency)))
+        wall = time.perf_counter() - wall_start
+
+    result = summarize(latencies)
+    result["ops_per_sec"] = round(len(latencies) / wall, 2) if wall else 0.0
+    result["concurrency"] = concurrency
+    return result
+
+
+def run_all(iterations: int, concurrency: int, export_sizes: List[int], only: str = "") -> Dict[str, Dict[str, float]]:
+    benchmarks: Dict[str, Callable[[], Any]] = {
+        "graph_cold": lambda: bench_graph_cold(iterations),
+        "graph_cached_stages": lambda: bench_graph_cached_stages(iterations),
+        "constructor_parse_small": lambda: bench_constructor_parse(iterations * 10, 6, fenced=False),
+        "constructor_parse_large_fenced": lambda: bench_constructor_parse(iterations, 200, fenced=True),
+        "chat_cache_hit": lambda: asyncio.run(bench_chat_cache_hit(iterations * 5)),
+        f"chat_concurrent_{concurrency}": lambda: asyncio.run(bench_chat_concurrent(max(1, iterations // 5), concurrency)),
+    }
+    for n_files in export_sizes:
+        benchmarks[f"export_zip_{n_files}_files"] = lambda n=n_files: asyncio.run(bench_export_zip(max(1, iterations // 2), n))
+
+    results = {}
+    for name, bench in benchmarks.items():
+        if only and only not in name:
+            continue
+        fake_llm.reset()
+        results[name] = bench()
+        print(f"{name:<36} p50={results[name].get('p50_ms', 0):>10.3f} ms  p95={results[name].get('p95_ms', 0):>10.3f} ms")
+    return results
+
+
+# --- Informes ---
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_report(results: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "provider": os.getenv("LLM_PROVIDER"),
+            "fake_llm": {k: v for k, v in os.environ.items() if k.startswith("FAKE_LLM_")},
+        },
+        "results": results,
+    }
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Print a p50 comparison table and return the names that regressed beyond `threshold`."""
+    regressions = []
+    base_results = baseline.get("results", {})
+    print(f"\n{'benchmark':<36} {'base p50':>12} {'new p50':>12} {'delta':>8}")
+    for name, stats in current.get("results", {}).items():
+        old = base_results.get(name, {}).get("p50_ms")
+        new = stats.get("p50_ms")
+        if not old or new is None:
+            print(f"{name:<36} {'-':>12} {new:>12.3f} {'new':>8}")
+            continue
+        delta = (new - old) / old
+        flag = "  REGRESSION" if delta > threshold else ""
+        print(f"{name:<36} {old:>12.3f} {new:>12.3f} {delta:>+7.1%}{flag}")
+        if delta > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Aegis Forge offline benchmarks (fake LLM provider)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--export-files", default="100,1000", help="Comma-separated file counts for /export")
+    parser.add_argument("--only", default="", help="Run only benchmarks whose name contains this text")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed p50 slowdown (0.15 = 15%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # Los benchmarks no deben chocar con el rate limit de /chat
+    main.limiter.enabled = False
+
+    export_sizes = [int(n) for n in args.export_files.split(",") if n.strip()]
+    report = build_report(run_all(args.iterations, args.concurrency, export_sizes, args.only))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.threshold)
+        if regressions and args.fail_on_regression:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,31 @@
+"""Utilidades de estadística compartidas por los benchmarks y el load test."""
+
+import math
+from typing import Dict, List
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile (pct in 0-100) of an unsorted sample list."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples_s: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds from samples in seconds."""
+    if not samples_s:
+        return {"iterations": 0}
+    ms = [s * 1000 for s in samples_s]
+    total = sum(samples_s)
+    return {
+        "iterations": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3),
+        "min_ms": round(min(ms), 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3),
+        "ops_per_sec": round(len(ms) / total, 2) if total else 0.0,
+    }
@@ -0,0 +1,225 @@
+"""
+Cachés en memoria acotadas por bytes (no por número de entradas).
+
+VISIONARY_CACHE, ARCHITECT_CACHE y CHAT_CACHE guardaban objetos completos
+(AIMessage con metadatos y payloads del proveedor, o respuestas con todos los
+ficheros generados) y solo limitaban el número de entradas, así que unas pocas
+generaciones grandes podían ocupar cientos de MB por worker. `BoundedCache`:
+
+- guarda solo el contenido extraído: strings tal cual (internados si son
+  cortos), dict/list como JSON compacto en bytes y bytes ya codificados
+  (p. ej. cuerpos HTTP listos para enviar) sin tocar;
+- comprime con zlib los valores a partir de CACHE_COMPRESS_MIN_BYTES;
+- las claves largas (p. ej. la conversación entera) se guardan como digest;
+- desaloja por bytes totales con política LRU o LFU (empate → LRU);
+- expone su huella de memoria con `stats()` (ver `GET /stats`).
+
+Variables de entorno:
+- CACHE_POLICY=lru | lfu
+- CACHE_COMPRESS_MIN_BYTES=2048
+- <NOMBRE>_CACHE_MAX_MB   (p. ej. CHAT_CACHE_MAX_MB=32)
+"""
+
+import os
+import sys
+import json
+import zlib
+import hashlib
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+CACHE_POLICY = os.getenv("CACHE_POLICY", "lru").lower()
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "2048"))
+
+# Coste fijo aproximado por entrada (nodo del OrderedDict, tupla, contadores)
+ENTRY_OVERHEAD_BYTES = 120
+# Claves más largas que esto se sustituyen por su sha256
+MAX_KEY_CHARS = 128
+# Strings de hasta este tamaño se internan en lugar de copiarse
+INTERN_MAX_CHARS = 256
+
+# Tipos de valor almacenado
+_STR, _JSON, _BYTES = 0, 1, 2
+
+# Orden de creación -> caché. Referencias débiles: una caché descartada (p. ej.
+# en tests) no queda viva por el registro
+_REGISTRY: "weakref.WeakValueDictionary[int, BoundedCache]" = weakref.WeakValueDictionary()
+_REGISTRY_IDS = itertools.count()
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _encode_json(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode_json(raw: bytes) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+class BoundedCache:
+    """
+    Thread-safe cache bounded by the total size of its stored payloads.
+
+    Values must be strings, bytes or JSON-serializable dicts/lists; `get`
+    returns a fresh copy, so callers may mutate results freely. Bytes are
+    stored as given (never recompressed): use them for pre-encoded payloads.
+    """
+
+    def __init__(self, name: str, max_bytes: int, policy: str = CACHE_POLICY,
+                 compress_min_bytes: int = CACHE_COMPRESS_MIN_BYTES):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown cache policy: {policy}")
+        self.name = name
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.compress_min_bytes = compress_min_bytes
+        self._lock = threading.Lock()
+        # clave -> (tipo, comprimido, payload, bytes contabilizados, bytes sin comprimir)
+        self._entries: "OrderedDict[str, Tuple[int, bool, Any, int, int]]" = OrderedDict()
+        self._freq: Dict[str, int] = {}
+        self._bytes = 0
+        self._raw_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with _REGISTRY_LOCK:
+            _REGISTRY[next(_REGISTRY_IDS)] = self
+
+    @classmethod
+    def from_env(cls, name: str, default_mb: float) -> "BoundedCache":
+        max_mb = float(os.getenv(f"{name.upper()}_CACHE_MAX_MB", str(default_mb)))
+        return cls(name, int(max_mb * 1024 * 1024))
+
+    @staticmethod
+    def _key(key: str) -> str:
+        if len(key) <= MAX_KEY_CHARS:
+            return key
+        return "sha256:" + hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _pack(self, value: Any) -> Tuple[int, bool, Any, int, int]:
+        if isinstance(value, bytes):
+            return _BYTES, False, value, len(value), len(value)
+        if isinstance(value, str):
+            kind, raw = _STR, value.encode("utf-8")
+        else:
+            kind, raw = _JSON, _encode_json(value)
+
+        if len(raw) >= self.compress_min_bytes:
+            packed = zlib.compress(raw, 1)
+            if len(packed) < len(raw):
+                return kind, True, packed, len(packed), len(raw)
+        if kind == _STR:
+            # Los strings cortos se internan; los largos se guardan tal cual
+            payload = sys.intern(value) if len(value) <= INTERN_MAX_CHARS else value
+            return kind, False, payload, len(raw), len(raw)
+        return kind, False, raw, len(raw), len(raw)
+
+    @staticmethod
+    def _unpack(entry: Tuple[int, bool, Any, int, int]) -> Any:
+        kind, compressed, payload, _, _ = entry
+        if kind == _BYTES:
+            return payload
+        if compressed:
+            payload = zlib.decompress(payload)
+        if kind == _STR:
+            return payload.decode("utf-8") if isinstance(payload, bytes) else payload
+        return _decode_json(payload)
+
+    def _evict_one(self):
+        if self.policy == "lfu":
+            # Mínima frecuencia; en empate, la menos reciente (orden del OrderedDict)
+            victim = min(self._entries, key=self._freq.__getitem__)
+        else:
+            victim = next(iter(self._entries))
+        self._remove(victim)
+        self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._freq.pop(key, None)
+        self._bytes -= entry[3] + len(key) + ENTRY_OVERHEAD_BYTES
+        self._raw_bytes -= entry[4]
+
+    def get(self, key: str, default: Any = None) -> Any:
+        key = self._key(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._freq[key] += 1
+            self.hits += 1
+        return self._unpack(entry)
+
+    def set(self, key: str, value: Any):
+        key = self._key(key)
+        entry = self._pack(value)
+        size = entry[3] + len(key) + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            freq = 1
+            if key in self._entries:
+                freq = self._freq.get(key, 0) + 1
+                self._remove(key)
+            if size > self.max_bytes:
+                # Nunca cabría: no vaciamos la caché por un único valor enorme
+                return
+            while self._entries and self._bytes + size > self.max_bytes:
+                self._evict_one()
+            self._entries[key] = entry
+            self._freq[key] = freq
+            self._bytes += size
+            self._raw_bytes += entry[4]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._key(key) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._freq.clear()
+            self._bytes = 0
+            self._raw_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            compressed = sum(1 for entry in self._entries.values() if entry[1])
+            return {
+                "policy": self.policy,
+                "entries": len(self._entries),
+                "compressed_entries": compressed,
+                "bytes": self._bytes,
+                "raw_bytes": self._raw_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def all_stats() -> Dict[str, Dict[str, Any]]:
+    """Footprint of every live cache in this process, by name (`name#2`, ... for repeated names)."""
+    with _REGISTRY_LOCK:
+        caches = [cache for _, cache in sorted(_REGISTRY.items())]
+    stats: Dict[str, Dict[str, Any]] = {}
+    for cache in caches:
+        name, n = cache.name, 1
+        while name in stats:
+            n += 1
+            name = f"{cache.name}#{n}"
+        stats[name] = cache.stats()
+    return stats
@@ -0,0 +1,206 @@
+"""
+Modo cassette para llamadas a modelos: grabación y reproducción.
+
+En modo `record` cada par petición/respuesta (con su duración) se añade a un
+fichero JSON Lines local, comprimido con gzip si la ruta termina en `.gz`.
+En modo `replay` las respuestas se sirven desde ese fichero de forma
+determinista, sin red ni cuota, opcionalmente respetando la latencia original.
+Las llamadas que fallaron (tras los reintentos) se graban con su error y en
+replay vuelven a fallar con `RecordedCallError`, cuyo mensaje conserva el tipo y
+el texto del original (un 429 sigue mapeándose a 429). En replay los agentes no
+construyen el cliente del modelo (`model_config.get_routed_model` devuelve None),
+así que no hacen falta claves de API.
+
+Variables de entorno:
+- LLM_CASSETTE_MODE="off" | "record" | "replay"   (por defecto "off")
+- LLM_CASSETTE_PATH=llm_cassette.jsonl.gz
+- LLM_CASSETTE_SPEED=0   0 = sin espera, 1 = latencia original, 10 = 10x más rápido
+
+Las claves dependen solo del contenido de los mensajes (no del modelo), así
+que una grabación de Gemini puede reproducirse con LLM_PROVIDER=fake.
+Para grabar con varios workers de Uvicorn usa un fichero por worker.
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from langchain_core.messages import AIMessage
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "llm_cassette.jsonl.gz"
+
+
+class CassetteMissError(Exception):
+    """Replay requested for a call that is not in the cassette."""
+
+
+class RecordedCallError(Exception):
+    """Replay of a call that failed while recording."""
+
+
+def _serialize_messages(messages: Any) -> List[Dict[str, Any]]:
+    # /refine invoca el modelo con un string en lugar de una lista de mensajes
+    if isinstance(messages, str):
+        return [{"type": "human", "content": messages}]
+    return [{"type": getattr(m, "type", "human"), "content": getattr(m, "content", str(m))} for m in messages]
+
+
+def _cassette_key(serialized: List[Dict[str, Any]]) -> str:
+    raw = json.dumps(serialized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def model_name(model: Any) -> str:
+    return str(getattr(model, "model", None) or getattr(model, "model_name", None) or type(model).__name__)
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Cassette:
+    """Append-only log of model calls that can be replayed deterministically."""
+
+    def __init__(self, path: str, mode: str, speed: float = 0.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with _open(self.path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+        logger.info("Cassette %s loaded: %s distinct calls", self.path, len(self._entries))
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._entries.values())
+
+    def record(self, model: Any, messages: Any, response: Any, elapsed_s: float,
+               error: Optional[BaseException] = None):
+        serialized = _serialize_messages(messages)
+        entry = {
+            "key": _cassette_key(serialized),
+            "model": model_name(model),
+            "messages": serialized,
+            "elapsed_s": round(elapsed_s, 4),
+            "ts": time.time(),
+        }
+        if error is not None:
+            entry["error"] = {"type": type(error).__name__, "message": str(error)}
+        else:
+            entry["response"] = getattr(response, "content", str(response))
+            entry["usage"] = getattr(response, "usage_metadata", None)
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with _open(self.path, "a") as f:
+                f.write(line)
+            self._entries[entry["key"]].append(entry)
+
+    def replay(self, messages: Any) -> AIMessage:
+        key = _cassette_key(_serialize_messages(messages))
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMissError(f"No recorded response for call {key[:12]} in {self.path}")
+            # Llamadas repetidas con el mismo prompt se sirven en el orden grabado
+            entry = entries[self._cursor[key] % len(entries)]
+            self._cursor[key] += 1
+
+        if self.speed > 0:
+            time.sleep(entry.get("elapsed_s", 0) / self.speed)
+        if "error" in entry:
+            raise RecordedCallError(f"{entry['error']['type']}: {entry['error']['message']}")
+        return AIMessage(content=entry["response"], usage_metadata=entry.get("usage"))
+
+
+_ACTIVE: Optional[Cassette] = None
+_CONFIGURED = False
+_ACTIVE_LOCK = threading.Lock()
+
+
+def get_cassette() -> Optional[Cassette]:
+    """Cassette configured by LLM_CASSETTE_* (None when the mode is off)."""
+    global _ACTIVE, _CONFIGURED
+    if not _CONFIGURED:
+        with _ACTIVE_LOCK:
+            if not _CONFIGURED:
+                mode = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+                if mode in ("record", "replay"):
+                    _ACTIVE = Cassette(
+                        os.getenv("LLM_CASSETTE_PATH", DEFAULT_PATH),
+                        mode,
+                        float(os.getenv("LLM_CASSETTE_SPEED", "0")),
+                    )
+                _CONFIGURED = True
+    return _ACTIVE
+
+
+def use_cassette(cassette: Optional[Cassette]):
+    """Install (or remove, with None) the active cassette programmatically."""
+    global _ACTIVE, _CONFIGURED
+    with _ACTIVE_LOCK:
+        _ACTIVE = cassette
+        _CONFIGURED = True
+
+
+def is_replaying() -> bool:
+    cassette = get_cassette()
+    return cassette is not None and cassette.mode == "replay"
+
+
+def _plain_invoke(model: Any, messages: Any):
+    return model.invoke(messages)
+
+
+def invoke_with_cassette(model: Any, messages: Any, call: Callable[[Any, Any], Any] = _plain_invoke,
+                         not_recorded: Tuple[Type[BaseException], ...] = ()):
+    """
+    Route a model call through the active cassette.
+
+    `call` performs the real invocation (e.g. with retries); it is skipped
+    entirely in replay mode, so `model` may be None there. Exceptions in
+    `not_recorded` (the caller's own cancellations) propagate without being
+    recorded.
+    """
+    cassette = get_cassette()
+    if cassette is None:
+        return call(model, messages)
+    if cassette.mode == "replay":
+        with tracing.span("llm.replay"):
+            return cassette.replay(messages)
+
+    start = time.perf_counter()
+    try:
+        response = call(model, messages)
+    except not_recorded:
+        raise
+    except Exception as e:
+        cassette.record(model, messages, None, time.perf_counter() - start, error=e)
+        raise
+    cassette.record(model, messages, response, time.perf_counter() - start)
+    return response
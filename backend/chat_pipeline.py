@@ -0,0 +1,121 @@
+"""
+Pipeline de chat compartido por /chat y /chat/batch.
+
+`run_chat_graph` es bloqueante (graph.invoke y los SDK de los proveedores son
+síncronos), así que los endpoints lo ejecutan con `asyncio.to_thread`. Dentro
+del hilo:
+
+- el perfil de la petición (`X-Profile: 1`) sigue capturando el grafo gracias
+  a `profiling.profile_thread()`;
+- el grafo avanza nodo a nodo con `graph.stream` y comprueba entre nodos el
+  `threading.Event` de cancelación, porque cancelar la tarea asyncio no puede
+  detener un hilo ya en marcha. La llamada al modelo en curso termina, pero no
+  se lanza la siguiente.
+"""
+
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from fastapi import HTTPException
+from langchain_core.messages import AIMessage, HumanMessage
+
+from . import bounded_cache
+from . import profiling
+from . import templates
+from . import threads
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+# Intentar importar el grafo (LangGraph)
+try:
+    from .graph import graph
+except ImportError as e:
+    logger.error(f"⚠️ Error FATAL importando graph: {e}")
+    graph = None
+
+# Caché de respuestas de /chat (acotada por bytes, ver bounded_cache.py), indexada por result_id
+CHAT_CACHE = bounded_cache.BoundedCache.from_env("chat", default_mb=32)
+
+
+def result_id(message: str) -> str:
+    """Stable id of the cached generation for a message (CHAT_CACHE key, `GET /chat/results/{id}`)."""
+    return hashlib.sha256(message.strip().encode("utf-8")).hexdigest()[:32]
+
+
+class ChatCancelled(Exception):
+    """The caller went away; the graph stopped before its next node."""
+
+
+def run_chat_graph(message: str, request_id: str = "", thread_id: Optional[str] = None,
+                   cancelled: Optional[threading.Event] = None) -> dict:
+    """Ejecuta el grafo para un mensaje y devuelve la respuesta ya formateada."""
+    # Hilo explícito: resumen acumulado + últimos turnos (ver threads.py)
+    history = threads.THREADS.history(thread_id) if thread_id else []
+
+    # Plantilla precalculada más cercana: Arquitecto y Constructor parten de ella.
+    # Solo al empezar: en un hilo, el mensaje nuevo modifica el proyecto existente
+    template = None if history else templates.match(message)
+    template_id = template["id"] if template else ""
+    if template_id:
+        tracing.add_event("template.match", template_id=template_id)
+
+    # Estado inicial para LangGraph
+    initial_state = {
+        "messages": history + [HumanMessage(content=message)],
+        "spec_document": "",
+        "current_plan": [],
+        "code_diffs": [],
+        "retry_count": 0,
+        "build_status": "clean",
+        "request_id": request_id,
+        "template_id": template_id,
+    }
+
+    # Ejecutar el agente (stream_mode="values": el último estado es el resultado de invoke)
+    result = initial_state
+    with profiling.profile_thread():
+        for state in graph.stream(initial_state, stream_mode="values"):
+            result = state
+            if cancelled is not None and cancelled.is_set():
+                raise ChatCancelled(request_id)
+
+    # Procesar respuesta
+    last_message = result["messages"][-1]
+
+    if thread_id:
+        # Se guarda el turno (mensaje, spec y respuesta final); el resumen corre en segundo plano
+        threads.THREADS.record_turn(thread_id, [
+            HumanMessage(content=message),
+            AIMessage(content=result.get("spec_document", "")),
+            last_message,
+        ])
+
+    # Formatear código generado
+    code_diffs = []
+    if result.get("code_diffs"):
+        for item in result["code_diffs"]:
+            if isinstance(item, tuple):
+                code_diffs.append({"filepath": item[0], "content": item[1]})
+            elif isinstance(item, dict):
+                filepath = item.get("filepath", item.get("file_path", ""))
+                content = item.get("content", item.get("code", ""))
+                code_diffs.append({"filepath": filepath, "content": content})
+
+    return {
+        "response": last_message.content,
+        "spec_document": result.get("spec_document", ""),
+        "plan": result.get("current_plan", []),
+        "code_generated": code_diffs,
+        "build_status": result.get("build_status", "clean"),
+        "template_id": template_id or None,
+    }
+
+
+def chat_error(e: Exception) -> HTTPException:
+    # Manejo de error de cuota de Gemini
+    if "429" in str(e) or "ResourceExhausted" in str(e):
+        return HTTPException(status_code=429, detail="Cuota de IA excedida. Intenta más tarde.")
+    return HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,214 @@
+"""
+Proveedor LLM falso y determinista (LLM_PROVIDER="fake").
+
+Sirve para benchmarks, pruebas de carga y tests sin red ni cuota. Devuelve
+respuestas sintéticas con la forma que espera cada rol (spec Markdown para el
+Visionario, JSON de tareas para el Arquitecto, JSON de archivos para el
+Constructor) o respuestas grabadas desde un fichero JSON.
+
+Variables de entorno:
+- FAKE_LLM_RESPONSES=/ruta.json   {"visionary": ["..."], "architect": ["..."]} (se recorren en ciclo)
+- FAKE_LLM_LATENCY_MS=0           latencia fija antes del primer token
+- FAKE_LLM_TOKENS_PER_SEC=0       velocidad de generación (0 = instantáneo)
+- FAKE_LLM_ERROR_RATE=0.0         probabilidad de lanzar un error tipo 429 por llamada
+- FAKE_LLM_SEED=0                 semilla del generador (errores y contenido)
+- FAKE_LLM_TASKS=5                tareas del plan sintético
+- FAKE_LLM_FILES=6                archivos generados por el Constructor sintético
+- FAKE_LLM_FILE_CHARS=2000        tamaño aproximado de cada archivo sintético
+"""
+
+import os
+import json
+import time
+import random
+import threading
+from itertools import count
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class FakeProviderError(Exception):
+    """Injected provider failure (looks like a quota error to the retry layer)."""
+
+
+# Estado compartido por rol: el Constructor crea un modelo nuevo por llamada,
+# así que la secuencia (errores, respuestas grabadas) no puede vivir en la instancia.
+_RNGS: Dict[str, random.Random] = {}
+_COUNTERS: Dict[str, Any] = {}
+_LOCK = threading.Lock()
+_RECORDED: Optional[Dict[str, List[str]]] = None
+
+
+def _rng(role: str, seed: int) -> random.Random:
+    with _LOCK:
+        if role not in _RNGS:
+            _RNGS[role] = random.Random(f"{seed}:{role}")
+        return _RNGS[role]
+
+
+def _next_index(role: str) -> int:
+    with _LOCK:
+        return next(_COUNTERS.setdefault(role, count()))
+
+
+def _recorded_responses() -> Dict[str, List[str]]:
+    global _RECORDED
+    if _RECORDED is None:
+        path = os.getenv("FAKE_LLM_RESPONSES")
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                _RECORDED = json.load(f)
+        else:
+            _RECORDED = {}
+    return _RECORDED
+
+
+def reset():
+    """Reset RNGs, counters and recorded responses (benchmarks call this between runs)."""
+    global _RECORDED
+    with _LOCK:
+        _RNGS.clear()
+        _COUNTERS.clear()
+        _RECORDED = None
+
+
+def _last_text(messages: List[BaseMessage]) -> str:
+    for msg in reversed(messages):
+        if getattr(msg, "type", "") == "human" and msg.content:
+            return str(msg.content)
+    return str(messages[-1].content) if messages else ""
+
+
+def _synthetic_spec(prompt: str, index: int) -> str:
+    title = prompt.strip().splitlines()[0][:80] if prompt.strip() else "Proyecto"
+    sections = [
+        f"# Especificación: {title}",
+        "## Resumen\nAplicación generada a partir de la idea del usuario. " * 3,
+        "## Historias de usuario\n" + "\n".join(f"- Como usuario quiero la función {i} para lograr el objetivo {i}." for i in range(1, 7)),
+        "## Restricciones técnicas\n- Frontend Next.js + TypeScript\n- Backend FastAPI\n- Base de datos PostgreSQL",
+        "## Criterios de éxito\n" + "\n".join(f"- Criterio {i} verificable." for i in range(1, 5)),
+        f"<!-- fake:{index} -->",
+    ]
+    return "\n\n".join(sections)
+
+
+def _synthetic_plan(n_tasks: int) -> str:
+    tasks = [
+        {"id": f"TASK-{i:03d}", "description": f"Implementar el módulo {i} descrito en la especificación", "status": "pending"}
+        for i in range(1, n_tasks + 1)
+    ]
+    return json.dumps({"tasks": tasks}, ensure_ascii=False)
+
+
+def _synthetic_file(path: str, n_chars: int) -> str:
+    line = f"// {path}: línea de código sintético para pruebas de rendimiento\n"
+    return (line * (n_chars // len(line) + 1))[:n_chars]
+
+
+def _synthetic_files(n_files: int, n_chars: int) -> str:
+    files = {f"src/module_{i}/index.ts": _synthetic_file(f"src/module_{i}/index.ts", n_chars) for i in range(1, n_files + 1)}
+    return json.dumps({
+        "file_structure": files,
+        "warnings": [],
+        "next_step": "Revisar el código generado",
+    }, ensure_ascii=False)
+
+
+def _synthetic_refine(prompt: str, n_chars: int) -> str:
+    # El prompt de /refine incluye los archivos actuales; devolvemos el primero modificado
+    start = prompt.find("{")
+    filename = "src/refined.ts"
+    if start != -1:
+        try:
+            current = json.JSONDecoder().raw_decode(prompt[start:])[0]
+            if isinstance(current, dict) and current:
+                filename = next(iter(current))
+        except ValueError:
+            pass
+    return json.dumps({filename: _synthetic_file(filename, n_chars)}, ensure_ascii=False)
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model with configurable latency, token rate and error injection."""
+
+    role: str = "default"
+    model: str = "fake"
+    latency_ms: float = 0.0
+    tokens_per_sec: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+    n_tasks: int = 5
+    n_files: int = 6
+    file_chars: int = 2000
+    max_tokens: int = 8192
+
+    @classmethod
+    def from_env(cls, role: str, max_tokens: int = 8192, model: Optional[str] = None) -> "FakeChatModel":
+        return cls(
+            role=role,
+            model=model or f"fake-{role}",
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "0")),
+            tokens_per_sec=float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "0")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            seed=int(os.getenv("FAKE_LLM_SEED", "0")),
+            n_tasks=int(os.getenv("FAKE_LLM_TASKS", "5")),
+            n_files=int(os.getenv("FAKE_LLM_FILES", "6")),
+            file_chars=int(os.getenv("FAKE_LLM_FILE_CHARS", "2000")),
+            max_tokens=max_tokens,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "aegis-fake"
+
+    def _response_text(self, messages: List[BaseMessage]) -> str:
+        index = _next_index(self.role)
+        recorded = _recorded_responses().get(self.role)
+        if recorded:
+            return recorded[index % len(recorded)]
+
+        if self.role == "visionary":
+            return _synthetic_spec(_last_text(messages), index)
+        if self.role == "architect":
+            return _synthetic_plan(self.n_tasks)
+        if self.role == "constructor":
+            return _synthetic_files(self.n_files, self.file_chars)
+        if self.role == "refiner":
+            return _synthetic_refine(_last_text(messages), self.file_chars)
+        return _last_text(messages)
+
+    def _before_call(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if self.error_rate and _rng(self.role, self.seed).random() < self.error_rate:
+            raise FakeProviderError("429 RESOURCE_EXHAUSTED (fake provider injected error)")
+
+    def _usage(self, messages: List[BaseMessage], text: str) -> Dict[str, int]:
+        # Aproximación ~4 caracteres por token
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = len(text) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        self._before_call()
+        text = self._response_text(messages)
+        if self.tokens_per_sec:
+            time.sleep(len(text) / 4 / self.tokens_per_sec)
+        message = AIMessage(content=text, usage_metadata=self._usage(messages, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self._before_call()
+        text = self._response_text(messages)
+        chunk_chars = 64
+        for i in range(0, len(text), chunk_chars):
+            piece = text[i:i + chunk_chars]
+            if self.tokens_per_sec:
+                time.sleep(len(piece) / 4 / self.tokens_per_sec)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
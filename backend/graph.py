@@ -3,14 +3,15 @@ from .state import ProjectState
 from .agent_visionary import visionary_agent
 from .agent_architect import architect_agent
 from .agent_constructor import constructor_node
+from .tracing import traced_node
 
 def create_graph():
     workflow = StateGraph(ProjectState)
 
     # Add nodes
-    workflow.add_node("visionary", visionary_agent)
-    workflow.add_node("architect", architect_agent)
-    workflow.add_node("constructor", constructor_node)
+    workflow.add_node("visionary", traced_node("visionary", visionary_agent))
+    workflow.add_node("architect", traced_node("architect", architect_agent))
+    workflow.add_node("constructor", traced_node("constructor", constructor_node))
 
     # Define edges
     workflow.set_entry_point("visionary")
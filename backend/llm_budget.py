@@ -0,0 +1,127 @@
+"""
+Presupuesto global de tokens LLM del proceso y corrección de cada reserva.
+
+`budget()` devuelve el `TokenBudget` (ver shared_limits.py) del proceso: /chat,
+/chat/batch, /refine, la especulación y los resúmenes de hilos cargan contra
+el mismo. Antes de trabajar se reserva una estimación
+(`estimate_request_tokens`); al terminar, `Reservation.settle()` la sustituye
+por los tokens que informó el proveedor (`usage_metadata`). retry_utils anota
+el uso de cada llamada en la reserva activa del contexto (`charging`).
+
+Si alguna llamada no informó su uso (proveedor sin usage_metadata, error o
+llamada cortada), no se sabe cuánto gastó: la reserva solo puede crecer. Una
+ejecución sin llamadas al modelo (replay de cassette) devuelve la reserva
+entera.
+
+Las operaciones sobre el almacén son bloqueantes: desde el event loop se
+llaman con `asyncio.to_thread`.
+
+Variables de entorno:
+- LLM_REQUEST_TOKEN_ESTIMATE=12000  tokens de salida estimados por ejecución del grafo
+"""
+
+import os
+import math
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .shared_limits import TokenBudget
+
+_BUDGET: Optional[TokenBudget] = None
+_BUDGET_LOCK = threading.Lock()
+
+# Reserva a la que se cargan las llamadas al modelo del contexto actual
+_ACTIVE: ContextVar[Optional["Reservation"]] = ContextVar("aegis_token_reservation", default=None)
+
+
+def budget() -> TokenBudget:
+    """Process-wide TokenBudget built from the environment on first use."""
+    global _BUDGET
+    with _BUDGET_LOCK:
+        if _BUDGET is None:
+            _BUDGET = TokenBudget.from_env()
+        return _BUDGET
+
+
+def estimate_request_tokens(prompt: str) -> int:
+    """Rough input (~4 chars/token) plus expected output tokens for one graph run."""
+    return len(prompt) // 4 + int(os.getenv("LLM_REQUEST_TOKEN_ESTIMATE", "12000"))
+
+
+class Reservation:
+    """Tokens reserved in one budget window, corrected with the real usage when settled."""
+
+    def __init__(self, token_budget: TokenBudget, key: str, tokens: int):
+        self.budget = token_budget
+        self.key = key
+        self.tokens = tokens
+        self.used = 0
+        self.unreported = 0
+        self.charged: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def add_usage(self, usage: Optional[Dict[str, Any]]):
+        with self._lock:
+            if not usage:
+                self.unreported += 1
+                return
+            self.used += int(usage.get("total_tokens")
+                             or usage.get("input_tokens", 0) + usage.get("output_tokens", 0))
+
+    def settle(self) -> int:
+        """Replace the estimate with the real usage (once); returns the tokens finally charged."""
+        with self._lock:
+            if self.charged is not None:
+                return self.charged
+            self.charged = max(self.used, self.tokens) if self.unreported else self.used
+        self.budget.adjust(self.key, self.charged - self.tokens)
+        return self.charged
+
+
+def reserve(tokens: int, token_budget: Optional[TokenBudget] = None) -> Tuple[Optional[Reservation], float]:
+    """Reserve `tokens`; returns (reservation or None if rejected, retry_after_seconds). Blocking."""
+    token_budget = token_budget or budget()
+    reserved, retry_after = token_budget.reserve(tokens)
+    if reserved is None:
+        return None, retry_after
+    return Reservation(token_budget, *reserved), 0.0
+
+
+async def admit(text: str, token_budget: Optional[TokenBudget] = None) -> Reservation:
+    """Reserve the estimated tokens for `text` off the event loop, or reject the request with 429."""
+    reservation, retry_after = await asyncio.to_thread(reserve, estimate_request_tokens(text), token_budget)
+    if reservation is None:
+        raise HTTPException(status_code=429, detail="Presupuesto de tokens de IA agotado. Intenta más tarde.",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+    return reservation
+
+
+@contextmanager
+def charging(reservation: Reservation):
+    """Charge the model calls made inside this block to `reservation`."""
+    token = _ACTIVE.set(reservation)
+    try:
+        yield
+    finally:
+        _ACTIVE.reset(token)
+
+
+def record_usage(usage: Optional[Dict[str, Any]]):
+    """Add one model call to the active reservation (`None`: usage unknown)."""
+    reservation = _ACTIVE.get()
+    if reservation is not None:
+        reservation.add_usage(usage)
+
+
+def run_charged(reservation: Reservation, fn: Callable[..., Any], *args) -> Any:
+    """Run `fn(*args)` charging its model calls to `reservation`, then settle it. Blocking."""
+    with charging(reservation):
+        try:
+            return fn(*args)
+        finally:
+            reservation.settle()
@@ -1,11 +1,9 @@
 import os
 import io
-import json
+import asyncio
 import zipfile
 import logging
-import re
-from typing import Dict, List, Any, Optional
-from collections import OrderedDict
+from typing import Dict, List, Optional
 
 # Framework Imports
 from fastapi import FastAPI, HTTPException, status, Request
@@ -14,15 +12,11 @@ from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-# LangChain / AI Imports
-from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-
 # Rate Limiting
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from slowapi.middleware import SlowAPIMiddleware
+from limits import parse as parse_limit
 
 # 1. CONFIGURACIÓN E INICIALIZACIÓN
 # Cargar .env desde la raíz del proyecto
@@ -32,25 +26,47 @@ load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn")
 
-# Intentar importar el grafo (LangGraph)
-try:
-    # Intento 1: Importación absoluta (Funciona en Render/Producción)
-    from graph import graph
-except ImportError:
-    try:
-        # Intento 2: Importación relativa (Funciona en Local/Paquete)
-        from .graph import graph
-    except ImportError as e:
-        logger.error(f"⚠️ Error FATAL importando graph: {e}")
-        graph = None
+# Vacuna #008: todos los módulos del backend usan imports relativos, así que la
+# app se carga siempre como paquete: `uvicorn backend.main:app` desde la raíz
+# (render_start.sh, Dockerfile).
+if not __package__:
+    raise ImportError("El backend debe ejecutarse como paquete: `uvicorn backend.main:app` desde la raíz del repo")
+
+from . import tracing
+from . import profiling
+from . import cassette
+from . import shared_limits
+from . import rate_limits
+from . import llm_budget
+from . import speculation
+from . import responses
+from . import bounded_cache
+from . import threads
+from . import batch
+from . import refine
+# El grafo (LangGraph) y la caché de /chat viven en chat_pipeline; graph es None si no se pudo importar
+from .chat_pipeline import CHAT_CACHE, graph, run_chat_graph, chat_error, result_id
+from .model_config import PROVIDER
 
 # Inicializar App
 app = FastAPI(title="Aegis Forge Backend")
 
 # 2. RATE LIMITING (Protección contra abuso)
-limiter = Limiter(key_func=get_remote_address, default_limits=["60/minute"])
+# Contadores compartidos entre workers (SQLite local o Redis, ver shared_limits.py)
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=["60/minute"],
+    storage_uri=shared_limits.storage_uri(),
+)
+# Cada ejecución del grafo cuenta contra el mismo límite por cliente:
+# /chat y cada prompt nuevo (no cacheado) de /chat/batch
+CHAT_RUN_LIMIT = "5/minute"
+CHAT_RUN_SCOPE = "chat-runs"
+# Presupuesto global de tokens LLM/minuto: se reserva antes de lanzar el grafo
+token_budget = llm_budget.budget()
 app.state.limiter = limiter
-app.add_middleware(SlowAPIMiddleware)
+# Como SlowAPIMiddleware, pero la comprobación (SQLite/Redis) corre fuera del event loop
+app.add_middleware(rate_limits.OffloopRateLimitMiddleware)
 
 def _rate_limit_exceeded_handler(request, exc):
     return JSONResponse(
@@ -59,6 +75,40 @@ def _rate_limit_exceeded_handler(request, exc):
     )
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# 2b. TRAZAS POR PETICIÓN (request id + span tree + perfilado opcional)
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # X-Request-ID del cliente solo si es un token seguro y no está en uso
+    request_id, trace = tracing.begin_request(request.headers.get("x-request-id"))
+    request.state.request_id = request_id
+
+    profiler = response = None
+    try:
+        # Perfil de CPU solo si se pide con `X-Profile: 1` y está autorizado
+        if profiling.profiling_allowed(request.headers):
+            profiler = profiling.RequestProfiler(request_id)
+            if not profiler.start():
+                profiler = None
+
+        with tracing.span("http.request", request_id=request_id,
+                          method=request.method, path=request.url.path) as root:
+            response = await call_next(request)
+            if root is not None:
+                root.set_attribute("status_code", response.status_code)
+    finally:
+        if profiler:
+            profiler.stop()
+        if trace and response is None:
+            tracing.export_trace(trace)
+    if trace:
+        # Tras enviar el cuerpo: /chat/batch sigue generando spans mientras hace streaming
+        tracing.export_when_sent(response, trace)
+
+    response.headers["X-Request-ID"] = request_id
+    if profiler and profiler.path:
+        response.headers["X-Profile-File"] = os.path.basename(profiler.path)
+    return response
+
 # 3. CORS (Configuración para Vercel y Localhost)
 def get_allowed_origins():
     # Lee variable de entorno ALLOWED_ORIGINS (si existe en Render)
@@ -81,6 +131,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # El frontend lee estas cabeceras (revalidación y correlación con las trazas)
+    expose_headers=["ETag", "Content-Location", "X-Request-ID"],
 )
 
 # 4. MODELOS DE DATOS (Pydantic)
@@ -95,92 +147,120 @@ class RefineRequest(BaseModel):
     instruction: str
     current_files: Dict[str, str]
 
-# 5. CACHÉ SIMPLE (LRU)
-CHAT_CACHE: OrderedDict[str, dict] = OrderedDict()
-CACHE_SIZE = 20
+class BatchChatRequest(BaseModel):
+    prompts: List[str]
+    max_concurrency: Optional[int] = None
 
-# 6. ENDPOINTS
+# 5. ENDPOINTS
 
 @app.get("/")
 def read_root():
     """Health Check Endpoint"""
     return {"status": "Backend Online", "service": "Aegis Forge V1.0"}
 
+@app.get("/stats")
+def read_stats():
+    """Contadores internos (especulación, huella de las cachés e hilos de conversación)"""
+    return {
+        "speculation": speculation.STATS.snapshot(),
+        "caches": bounded_cache.all_stats(),
+        "threads": threads.THREADS.stats(),
+    }
+
 @app.post("/chat")
-@limiter.limit("5/minute")
+@limiter.shared_limit(CHAT_RUN_LIMIT, scope=CHAT_RUN_SCOPE)
 async def chat(request: Request, payload: ChatRequest):
     if not graph:
         raise HTTPException(status_code=500, detail="El Grafo de IA no se cargó correctamente.")
 
-    # Verificar Caché
-    cache_key = payload.message.strip()
-    if cache_key in CHAT_CACHE:
-        CHAT_CACHE.move_to_end(cache_key)
-        return CHAT_CACHE[cache_key]
+    # Un thread_id explícito continúa una conversación: su respuesta depende del historial
+    thread_id = payload.thread_id if payload.thread_id and payload.thread_id != "default" else None
+
+    # Verificar Caché (la generación queda disponible en GET /chat/results/{id})
+    message = payload.message.strip()
+    cache_key = result_id(message)
+    location = {} if thread_id else {"Content-Location": f"/chat/results/{cache_key}"}
+    cached = None if thread_id else CHAT_CACHE.get(cache_key)
+    if cached is not None:
+        tracing.add_event("cache.hit", cache="chat")
+        return await responses.encoded_response(request, responses.EncodedJSON.unpack(cached), headers=location)
 
     if not payload.message or not payload.message.strip():
         raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío.")
 
-    # Estado inicial para LangGraph
-    initial_state = {
-        "messages": [HumanMessage(content=payload.message.strip())],
-        "spec_document": "",
-        "current_plan": [],
-        "code_diffs": [],
-        "retry_count": 0,
-        "build_status": "clean"
-    }
+    # Admission control: no arrancar el grafo si el presupuesto de tokens está agotado
+    reservation = await llm_budget.admit(payload.message, token_budget)
 
     try:
-        # Ejecutar el agente
-        result = graph.invoke(initial_state)
-        
-        # Procesar respuesta
-        last_message = result["messages"][-1]
-        
-        # Formatear código generado
-        code_diffs = []
-        if result.get("code_diffs"):
-            for item in result["code_diffs"]:
-                if isinstance(item, tuple):
-                    code_diffs.append({"filepath": item[0], "content": item[1]})
-                elif isinstance(item, dict):
-                    filepath = item.get("filepath", item.get("file_path", ""))
-                    content = item.get("content", item.get("code", ""))
-                    code_diffs.append({"filepath": filepath, "content": content})
-
-        response_payload = {
-            "response": last_message.content,
-            "spec_document": result.get("spec_document", ""),
-            "plan": result.get("current_plan", []),
-            "code_generated": code_diffs,
-            "build_status": result.get("build_status", "clean")
-        }
-
-        # Guardar en caché
-        CHAT_CACHE[cache_key] = response_payload
-        if len(CHAT_CACHE) > CACHE_SIZE:
-            CHAT_CACHE.popitem(last=False)
-
-        return response_payload
+        # El grafo es bloqueante: se ejecuta en un hilo para no congelar el event loop.
+        # Al terminar, la reserva se corrige con los tokens reales (ver llm_budget.py)
+        response_payload = await asyncio.to_thread(
+            llm_budget.run_charged, reservation,
+            run_chat_graph, message, getattr(request.state, "request_id", ""), thread_id
+        )
+        if thread_id:
+            return await responses.json_response(request, response_payload)
+        # Se codifica una sola vez: la caché guarda el cuerpo listo para enviar
+        encoded = await asyncio.to_thread(responses.encode_json, response_payload)
+        CHAT_CACHE.set(cache_key, encoded.pack())
+        return await responses.encoded_response(request, encoded, headers=location)
 
     except Exception as e:
         logger.error(f"Error en /chat: {str(e)}")
-        # Manejo de error de cuota de Gemini
-        if "429" in str(e) or "ResourceExhausted" in str(e):
-            raise HTTPException(status_code=429, detail="Cuota de IA excedida. Intenta más tarde.")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise chat_error(e)
+
+@app.get("/chat/results/{cache_key}")
+async def chat_result(request: Request, cache_key: str):
+    """Generación cacheada de /chat; revalidable con If-None-Match (304)"""
+    cached = CHAT_CACHE.get(cache_key)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Resultado no encontrado o expirado.")
+    return await responses.encoded_response(request, responses.EncodedJSON.unpack(cached))
+
+@app.post("/chat/batch")
+@limiter.limit("2/minute")
+async def chat_batch(request: Request, payload: BatchChatRequest):
+    """
+    Genera varios proyectos en una sola petición.
+
+    Deduplica prompts idénticos, sirve los cacheados al instante y ejecuta el
+    resto con concurrencia acotada bajo el presupuesto de tokens. Responde en
+    streaming NDJSON: una línea por prompt (en orden de finalización) y una
+    línea final con el resumen.
+    """
+    if not graph:
+        raise HTTPException(status_code=500, detail="El Grafo de IA no se cargó correctamente.")
+    if not payload.prompts:
+        raise HTTPException(status_code=400, detail="La lista de prompts no puede estar vacía.")
+    if len(payload.prompts) > batch.BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"Máximo {batch.BATCH_MAX_PROMPTS} prompts por lote.")
+
+    concurrency = max(1, min(payload.max_concurrency or batch.BATCH_CONCURRENCY, batch.BATCH_CONCURRENCY))
+    run_limit, client_key = parse_limit(CHAT_RUN_LIMIT), get_remote_address(request)
+
+    def charge_run() -> bool:
+        return not limiter.enabled or limiter.limiter.hit(run_limit, client_key, CHAT_RUN_SCOPE)
+
+    return StreamingResponse(
+        batch.batch_events(payload.prompts, concurrency, getattr(request.state, "request_id", ""),
+                           token_budget, charge_run),
+        media_type="application/x-ndjson",
+    )
+
+def _build_zip(files: Dict[str, str]) -> io.BytesIO:
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for file_path, content in files.items():
+            clean_path = file_path.replace("\\", "/") # Windows fix
+            zip_file.writestr(clean_path, content)
+    zip_buffer.seek(0)
+    return zip_buffer
 
 @app.post("/export")
 async def export_project(data: ExportRequest):
     try:
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for file_path, content in data.files.items():
-                clean_path = file_path.replace("\\", "/") # Windows fix
-                zip_file.writestr(clean_path, content)
-        
-        zip_buffer.seek(0)
+        # Comprimir es CPU: fuera del event loop
+        zip_buffer = await asyncio.to_thread(_build_zip, data.files)
         return StreamingResponse(
             zip_buffer,
             media_type="application/zip",
@@ -191,37 +271,21 @@ async def export_project(data: ExportRequest):
         raise HTTPException(status_code=500, detail="Error generando el archivo ZIP")
 
 @app.post("/refine")
-async def refine_code(request: RefineRequest):
-    print(f"🔧 Refinando código: {request.instruction}")
-    
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+async def refine_code(request: Request, payload: RefineRequest):
+    logger.info(f"🔧 Refinando código: {payload.instruction}")
+
+    # Vacuna #005: el modelo de refinamiento sale de model_config (rol "refiner")
+    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if PROVIDER == "google" and not api_key and not cassette.is_replaying():
         raise HTTPException(status_code=500, detail="Falta GEMINI_API_KEY en variables de entorno")
 
-    prompt = f"""
-    ACT AS: Senior Code Refactorer.
-    CONTEXT: {json.dumps(request.current_files, indent=2)}
-    INSTRUCTION: {request.instruction}
-    TASK: Rewrite ONLY the files that need modification.
-    OUTPUT: Valid JSON {{ "filename": "new content" }}.
-    """
+    prompt = refine.build_prompt(payload.current_files, payload.instruction)
+    reservation = await llm_budget.admit(prompt, token_budget)
 
     try:
-        refine_llm = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash",
-            temperature=0.1,
-            google_api_key=api_key
-        )
-        
-        response = refine_llm.invoke(prompt)
-        content = str(response.content).strip()
-        
-        # Limpieza de JSON (Markdown fix)
-        if content.startswith("```json"): content = content[7:-3].strip()
-        if content.startswith("```"): content = content[3:-3].strip()
-        
-        new_files = json.loads(content)
-        return {"success": True, "modified_files": new_files}
+        # La llamada al modelo es bloqueante: se ejecuta en un hilo (ver refine.py)
+        new_files = await asyncio.to_thread(llm_budget.run_charged, reservation, refine.refine_files, prompt)
+        return await responses.json_response(request, {"success": True, "modified_files": new_files})
         
     except Exception as e:
         logger.error(f"Error en refinamiento: {e}")
@@ -4,12 +4,19 @@ Configuración centralizada de Modelos (Gemini / Groq)
 Soporta múltiples proveedores:
 - Google Generative AI (Gemini)
 - Groq (Llama, Mixtral)
+- Fake (proveedor determinista sin red para benchmarks y tests, ver fake_llm.py)
 
-Controlado por la variable de entorno: LLM_PROVIDER="google" | "groq"
+Controlado por la variable de entorno: LLM_PROVIDER="google" | "groq" | "fake"
 """
 
 import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
 from dotenv import load_dotenv
+from . import cassette
+from . import tracing
 
 # Carga variables por si se invoca directamente
 load_dotenv()
@@ -22,6 +29,7 @@ AVAILABLE_MODELS_GOOGLE = {
     "architect": os.getenv("GEMINI_PRO_MODEL", "gemini-1.5-flash"),
     "constructor": os.getenv("GEMINI_PRO_MODEL", "gemini-1.5-flash"),
     "auditor": os.getenv("GEMINI_PRO_MODEL", "gemini-1.5-flash"),
+    "refiner": os.getenv("GEMINI_FLASH_MODEL", "gemini-1.5-flash"),
 }
 
 AVAILABLE_MODELS_GROQ = {
@@ -29,6 +37,15 @@ AVAILABLE_MODELS_GROQ = {
     "architect": "llama-3.3-70b-versatile",
     "constructor": "llama-3.3-70b-versatile",
     "auditor": "llama-3.3-70b-versatile",
+    "refiner": "llama-3.3-70b-versatile",
+}
+
+AVAILABLE_MODELS_FAKE = {
+    "visionary": "fake-visionary",
+    "architect": "fake-architect",
+    "constructor": "fake-constructor",
+    "auditor": "fake-auditor",
+    "refiner": "fake-refiner",
 }
 
 # Parámetros de inferencia por rol
@@ -50,36 +67,200 @@ MODEL_PARAMS = {
         "temperature": 0.1, 
         "max_tokens": 8192
     },
+    "refiner": {
+        "temperature": 0.1, 
+        "max_tokens": 8192
+    },
 }
 
+# Límite de tokens de salida que acepta cada modelo: la API rechaza valores
+# mayores (Gemini 1.5/2.0: maxOutputTokens 1-8192), así que el router nunca
+# pide más. "default" cubre los modelos no listados del proveedor.
+MAX_OUTPUT_TOKENS = {
+    "google": {"default": 8192, "gemini-2.5-pro": 65536, "gemini-2.5-flash": 65536},
+    "groq": {"default": 8192, "llama-3.3-70b-versatile": 32768},
+    "fake": {"default": 65536},
+}
+
+def output_token_limit(role: str, model_name: Optional[str] = None) -> int:
+    """Largest max_tokens accepted by `model_name` (or the role's default model)."""
+    limits = MAX_OUTPUT_TOKENS.get(PROVIDER, MAX_OUTPUT_TOKENS["google"])
+    model_name = model_name or {
+        "groq": AVAILABLE_MODELS_GROQ,
+        "fake": AVAILABLE_MODELS_FAKE,
+    }.get(PROVIDER, AVAILABLE_MODELS_GOOGLE).get(role, "")
+    return limits.get(model_name, limits["default"])
+
 # Backwards compatibility variable
-AVAILABLE_MODELS = AVAILABLE_MODELS_GROQ if PROVIDER == "groq" else AVAILABLE_MODELS_GOOGLE
+AVAILABLE_MODELS = {
+    "groq": AVAILABLE_MODELS_GROQ,
+    "fake": AVAILABLE_MODELS_FAKE,
+}.get(PROVIDER, AVAILABLE_MODELS_GOOGLE)
 
-def get_model(role: str):
+def get_model(role: str, model_name: Optional[str] = None, max_tokens: Optional[int] = None):
     """
     Factory function que retorna la instancia del modelo correcta
     según el proveedor configurado (Google o Groq).
+
+    `model_name` / `max_tokens` permiten al router sobrescribir el modelo y el
+    límite de salida del rol.
     """
     
     # Parámetros bases
     params = MODEL_PARAMS.get(role, {"temperature": 0.5, "max_tokens": 4096})
+    max_tokens = min(max_tokens or params.get("max_tokens", 4096), output_token_limit(role, model_name))
     
+    if PROVIDER == "fake":
+        from .fake_llm import FakeChatModel
+        return FakeChatModel.from_env(role, max_tokens=max_tokens, model=model_name)
+
     if PROVIDER == "groq":
         from langchain_groq import ChatGroq
-        model_name = AVAILABLE_MODELS_GROQ.get(role, "llama3-70b-8192")
+        model_name = model_name or AVAILABLE_MODELS_GROQ.get(role, "llama3-70b-8192")
         return ChatGroq(
             model=model_name,
             temperature=params.get("temperature", 0.5),
-            max_tokens=params.get("max_tokens", 4096),
+            max_tokens=max_tokens,
             api_key=os.getenv("GROQ_API_KEY")
         )
         
     else: # Default to Google
         from langchain_google_genai import ChatGoogleGenerativeAI
-        model_name = AVAILABLE_MODELS_GOOGLE.get(role, "gemini-1.5-flash")
+        model_name = model_name or AVAILABLE_MODELS_GOOGLE.get(role, "gemini-1.5-flash")
         return ChatGoogleGenerativeAI(
             model=model_name,
             temperature=params.get("temperature", 0.5),
-            max_tokens=params.get("max_tokens", 4096),
-            google_api_key=os.getenv("GOOGLE_API_KEY")
-        )
\ No newline at end of file
+            max_tokens=max_tokens,
+            google_api_key=os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+        )
+
+
+# --- Routing por complejidad ---
+# Cada llamada se puntúa barato (tamaño del prompt + longitud del plan) y se
+# asigna a un tier con su propio modelo. Las especificaciones cortas y las
+# tareas triviales van a un modelo más pequeño (no a un max_tokens menor: el
+# max_tokens del rol en MODEL_PARAMS es un mínimo, porque una salida cortada no
+# se puede parsear); solo los casos grandes pagan el modelo grande. Desactivable con MODEL_ROUTING=0 y configurable con
+# MODEL_ROUTING_TABLE=/ruta/tabla.json ({"tiers": {...}, "roles": {...}}).
+
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING", "1") != "0"
+
+# Modelo por tier y proveedor (None = el modelo por defecto del rol)
+ROUTING_TIERS = {
+    "fast": {
+        # `or`: en .env.example las variables están vacías
+        "google": os.getenv("GEMINI_FAST_MODEL") or "gemini-1.5-flash-8b",
+        "groq": os.getenv("GROQ_FAST_MODEL") or "llama-3.1-8b-instant",
+        "fake": "fake-fast",
+    },
+    "standard": {"google": None, "groq": None, "fake": None},
+    "large": {
+        "google": os.getenv("GEMINI_PRO_MODEL", "gemini-1.5-flash"),
+        "groq": "llama-3.3-70b-versatile",
+        "fake": "fake-large",
+    },
+}
+
+# Por rol: tiers en orden ascendente; se elige el primero con score <= max_score
+ROUTING_TABLE = {
+    "visionary": [
+        {"tier": "fast", "max_score": 1500, "max_tokens": 8192},
+        {"tier": "standard", "max_score": None, "max_tokens": 8192},
+    ],
+    "architect": [
+        {"tier": "fast", "max_score": 1500, "max_tokens": 8192},
+        {"tier": "standard", "max_score": 6000, "max_tokens": 8192},
+        {"tier": "large", "max_score": None, "max_tokens": 8192},
+    ],
+    "constructor": [
+        {"tier": "fast", "max_score": 2500, "max_tokens": 8192},
+        {"tier": "standard", "max_score": 9000, "max_tokens": 8192},
+        {"tier": "large", "max_score": None, "max_tokens": 16384},
+    ],
+    "refiner": [
+        {"tier": "fast", "max_score": 3000, "max_tokens": 8192},
+        {"tier": "standard", "max_score": None, "max_tokens": 8192},
+    ],
+}
+
+# Peso de cada tarea del plan (≈ tokens de salida que añade al Constructor)
+PLAN_TASK_WEIGHT = 400
+
+_routing_table_path = os.getenv("MODEL_ROUTING_TABLE")
+if _routing_table_path and os.path.exists(_routing_table_path):
+    with open(_routing_table_path, "r", encoding="utf-8") as _f:
+        _overrides = json.load(_f)
+    for _tier, _models in _overrides.get("tiers", {}).items():
+        ROUTING_TIERS.setdefault(_tier, {}).update(_models)
+    ROUTING_TABLE.update(_overrides.get("roles", {}))
+    PLAN_TASK_WEIGHT = _overrides.get("plan_task_weight", PLAN_TASK_WEIGHT)
+
+router_logger = logging.getLogger("aegis.router")
+
+_MODEL_INSTANCES: Dict[Tuple[str, Optional[str], Optional[int]], Any] = {}
+_MODEL_INSTANCES_LOCK = threading.Lock()
+
+
+def _prompt_chars(messages: Any) -> int:
+    if isinstance(messages, str):
+        return len(messages)
+    return sum(len(str(getattr(m, "content", m))) for m in messages)
+
+
+def score_request(role: str, messages: Any, plan: Any = None) -> int:
+    """Cheap complexity score: ~prompt tokens plus a fixed weight per plan task."""
+    plan_len = len(plan) if isinstance(plan, (list, tuple)) else 0
+    return _prompt_chars(messages) // 4 + plan_len * PLAN_TASK_WEIGHT
+
+
+def route_model(role: str, messages: Any, plan: Any = None, min_tier: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Pick tier, model and max_tokens for one call (logged for tuning).
+
+    `min_tier` skips the tiers below it (escalation after an unusable answer).
+    """
+    score = score_request(role, messages, plan)
+    tiers = ROUTING_TABLE.get(role)
+    if not MODEL_ROUTING_ENABLED or not tiers:
+        return {"role": role, "tier": "default", "model": None, "max_tokens": None, "score": score}
+    names = [t["tier"] for t in tiers]
+    if min_tier in names:
+        tiers = tiers[names.index(min_tier):]
+
+    entry = next((t for t in tiers if t.get("max_score") is None or score <= t["max_score"]), tiers[-1])
+    model = ROUTING_TIERS.get(entry["tier"], {}).get(PROVIDER)
+    # Nunca por debajo del max_tokens del rol (también en tablas de MODEL_ROUTING_TABLE)
+    max_tokens = max(entry.get("max_tokens") or 0, MODEL_PARAMS.get(role, {}).get("max_tokens", 0)) or None
+    if max_tokens:
+        # El tier "large" pide más salida solo a los modelos que la admiten
+        max_tokens = min(max_tokens, output_token_limit(role, model))
+    decision = {
+        "role": role,
+        "tier": entry["tier"],
+        "model": model,
+        "max_tokens": max_tokens,
+        "score": score,
+    }
+    router_logger.info(
+        "route role=%s score=%s tier=%s model=%s max_tokens=%s",
+        role, score, decision["tier"], decision["model"] or "default", decision["max_tokens"],
+    )
+    tracing.add_event("model.route", **{k: v for k, v in decision.items() if v is not None})
+    return decision
+
+
+def get_routed_model(role: str, messages: Any, plan: Any = None, min_tier: Optional[str] = None):
+    """
+    Model instance for this call according to the router (instances are reused).
+
+    None in cassette replay: responses come from the cassette and building the
+    client would require the provider's API key.
+    """
+    decision = route_model(role, messages, plan, min_tier)
+    if cassette.is_replaying():
+        return None
+    key = (role, decision["model"], decision["max_tokens"])
+    with _MODEL_INSTANCES_LOCK:
+        if key not in _MODEL_INSTANCES:
+            _MODEL_INSTANCES[key] = get_model(role, model_name=decision["model"], max_tokens=decision["max_tokens"])
+        return _MODEL_INSTANCES[key]
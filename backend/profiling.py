@@ -0,0 +1,166 @@
+"""
+Perfilado de CPU bajo demanda, por petición.
+
+Una petición con `X-Profile: 1` (y PROFILING_ENABLED o `X-Admin-Token`) se
+perfila entera, incluidos los hilos de `asyncio.to_thread` donde corre el
+grafo, y el perfil se escribe en PROFILE_DIR; la respuesta indica el fichero
+en `X-Profile-File`.
+
+Variables de entorno:
+- PROFILING_ENABLED="1"            (permite `X-Profile: 1` en cualquier petición)
+- ADMIN_TOKEN=...                  (permite `X-Profile: 1` con `X-Admin-Token`)
+- PROFILE_DIR=/ruta                (destino de los perfiles, por defecto TRACE_EXPORT_DIR o /tmp)
+"""
+
+import os
+import sys
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, List, Optional
+
+from .tracing import TRACE_EXPORT_DIR
+
+logger = logging.getLogger(__name__)
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "") or TRACE_EXPORT_DIR or "/tmp"
+
+
+def profiling_allowed(headers) -> bool:
+    """`X-Profile: 1` is honoured only with PROFILING_ENABLED or a valid admin token."""
+    if headers.get("x-profile") != "1":
+        return False
+    if PROFILING_ENABLED:
+        return True
+    admin_token = os.getenv("ADMIN_TOKEN")
+    return bool(admin_token) and headers.get("x-admin-token") == admin_token
+
+
+# Un solo perfil activo por proceso: cProfile (3.12+, sys.monitoring) no admite dos a la vez
+_PROFILE_LOCK = threading.Lock()
+_active_profiler: ContextVar[Optional["RequestProfiler"]] = ContextVar("aegis_active_profiler", default=None)
+# Desde 3.12 cProfile usa sys.monitoring, que ya observa todos los hilos
+_CPROFILE_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+def _new_profiler(kind: str):
+    if kind == "pyinstrument":
+        from pyinstrument import Profiler
+        return Profiler(async_mode="disabled")
+    import cProfile
+    return cProfile.Profile()
+
+
+class RequestProfiler:
+    """
+    CPU profile of a single request, including the worker threads it uses.
+
+    Uses pyinstrument (sampling, speedscope output for flamegraphs) when it is
+    installed, and falls back to cProfile (.prof, open with snakeviz/flameprof).
+    Both are bound to the thread that starts them, so code running in
+    `asyncio.to_thread` workers is profiled through `profile_thread()` and
+    merged into the same output.
+    """
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.path: Optional[str] = None
+        self._token = None
+        self._thread_profilers: List[Any] = []
+        self._threads_lock = threading.Lock()
+        try:
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled")
+            self._kind = "pyinstrument"
+        except ImportError:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._kind = "cprofile"
+
+    def start(self) -> bool:
+        """Start profiling; returns False (and does nothing) if another request is being profiled."""
+        if not _PROFILE_LOCK.acquire(blocking=False):
+            logger.info("Profiling skipped for %s: another profile is running", self.request_id)
+            return False
+        try:
+            if self._kind == "pyinstrument":
+                self._profiler.start()
+            else:
+                self._profiler.enable()
+        except Exception:
+            _PROFILE_LOCK.release()
+            raise
+        self._token = _active_profiler.set(self)
+        return True
+
+    @contextmanager
+    def _profile_current_thread(self):
+        if self._kind == "cprofile" and _CPROFILE_ALL_THREADS:
+            yield
+            return
+        profiler = _new_profiler(self._kind)
+        if self._kind == "pyinstrument":
+            profiler.start()
+        else:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if self._kind == "pyinstrument":
+                profiler.stop()
+            else:
+                profiler.disable()
+            with self._threads_lock:
+                self._thread_profilers.append(profiler)
+
+    def stop(self) -> Optional[str]:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with self._threads_lock:
+                thread_profilers = list(self._thread_profilers)
+            if self._kind == "pyinstrument":
+                self._profiler.stop()
+                from pyinstrument.renderers import SpeedscopeRenderer
+                from pyinstrument.session import Session
+                session = self._profiler.last_session
+                for profiler in thread_profilers:
+                    if profiler.last_session is not None:
+                        session = Session.combine(session, profiler.last_session)
+                self.path = os.path.join(PROFILE_DIR, f"profile-{self.request_id}.speedscope.json")
+                with open(self.path, "w", encoding="utf-8") as f:
+                    f.write(SpeedscopeRenderer().render(session))
+            else:
+                import pstats
+                self._profiler.disable()
+                stats = pstats.Stats(self._profiler)
+                for profiler in thread_profilers:
+                    stats.add(profiler)
+                self.path = os.path.join(PROFILE_DIR, f"profile-{self.request_id}.prof")
+                stats.dump_stats(self.path)
+        except OSError as e:
+            logger.warning("Profile export failed for %s: %s", self.request_id, e)
+            self.path = None
+        finally:
+            if self._token is not None:
+                _active_profiler.reset(self._token)
+                self._token = None
+                _PROFILE_LOCK.release()
+        return self.path
+
+
+@contextmanager
+def profile_thread():
+    """
+    Profile the enclosed block into the request's profile, if one is active.
+
+    Use it around work handed to another thread (e.g. via `asyncio.to_thread`,
+    which copies the request context).
+    """
+    profiler = _active_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler._profile_current_thread():
+        yield
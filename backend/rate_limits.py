@@ -0,0 +1,87 @@
+"""
+Integración de los límites compartidos con slowapi.
+
+- `SharedCounterStorage` registra el esquema `sqlite://` en `limits`, así que
+  `Limiter(storage_uri=shared_limits.storage_uri())` cuenta sobre el almacén
+  compartido (SQLite en el host o Redis, ver shared_limits.py).
+- `OffloopRateLimitMiddleware` sustituye a `SlowAPIMiddleware`: slowapi
+  comprueba los límites de forma síncrona (en su middleware y en los
+  decoradores de ruta), y con SQLite una escritura puede esperar hasta el
+  busy timeout de 5 s con el event loop bloqueado. Aquí la comprobación de los
+  límites por defecto y de los de cada ruta corre en un hilo y la petición
+  queda marcada como comprobada, de modo que los decoradores no repiten el
+  acceso al almacén.
+"""
+
+import math
+import time
+import asyncio
+import inspect
+import sqlite3
+from typing import Optional
+
+from limits.storage import Storage
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.middleware import _find_route_handler, _get_route_name
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from .shared_limits import counter_client_from_uri, incr_with_ttl
+
+
+class SharedCounterStorage(Storage):
+    """`limits` storage for slowapi backed by a Redis-compatible counter client."""
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: Optional[str] = None, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.client = counter_client_from_uri(uri or "memory://")
+
+    @property
+    def base_exceptions(self):
+        return (sqlite3.Error,)
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        # Primer hit de la ventana: la caducidad se fija en la misma operación
+        return incr_with_ttl(self.client, key, amount, int(math.ceil(expiry)))
+
+    def get(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+    def get_expiry(self, key: str) -> float:
+        return time.time() + max(self.client.pttl(key), 0) / 1000
+
+    def check(self) -> bool:
+        try:
+            return bool(self.client.ping())
+        except Exception:
+            return False
+
+    def reset(self) -> Optional[int]:
+        self.client.flushdb()
+        return None
+
+    def clear(self, key: str) -> None:
+        self.client.delete(key)
+
+
+class OffloopRateLimitMiddleware(BaseHTTPMiddleware):
+    """SlowAPIMiddleware equivalent whose limit checks run in a worker thread."""
+
+    async def dispatch(self, request, call_next):
+        limiter = request.app.state.limiter
+        handler = _find_route_handler(request.app.routes, request.scope)
+        if not limiter.enabled or handler is None:
+            return await call_next(request)
+
+        # Rutas con decorador: sus límites (como haría el decorador); el resto, los límites por defecto
+        name = _get_route_name(handler)
+        in_middleware = name not in limiter._route_limits and name not in limiter._dynamic_route_limits
+        try:
+            await asyncio.to_thread(limiter._check_request_limit, request, handler, in_middleware)
+        except RateLimitExceeded as e:
+            response = request.app.exception_handlers.get(RateLimitExceeded, _rate_limit_exceeded_handler)(request, e)
+            return await response if inspect.isawaitable(response) else response
+        request.state._rate_limiting_complete = True
+        return await call_next(request)
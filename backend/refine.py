@@ -0,0 +1,42 @@
+"""
+Refinamiento de código (`POST /refine`).
+
+La llamada al modelo es bloqueante: el endpoint ejecuta `refine_files` con
+`asyncio.to_thread` para no congelar el event loop. Pasa por
+`invoke_with_retry` como el resto de agentes (Vacuna #006: reintentos con
+backoff, spans de traza y cassette).
+"""
+
+import json
+from typing import Dict
+
+from langchain_core.messages import HumanMessage
+
+from .model_config import get_routed_model
+from .retry_utils import invoke_with_retry
+
+
+def build_prompt(current_files: Dict[str, str], instruction: str) -> str:
+    return f"""
+    ACT AS: Senior Code Refactorer.
+    CONTEXT: {json.dumps(current_files, indent=2)}
+    INSTRUCTION: {instruction}
+    TASK: Rewrite ONLY the files that need modification.
+    OUTPUT: Valid JSON {{ "filename": "new content" }}.
+    """
+
+
+def refine_files(prompt: str) -> Dict[str, str]:
+    """Invoke the refiner model and parse the modified files it returns."""
+    messages = [HumanMessage(content=prompt)]
+    # En replay es None: la respuesta sale de la cassette
+    refine_llm = get_routed_model("refiner", messages)
+
+    response = invoke_with_retry(refine_llm, messages)
+    content = str(response.content).strip()
+
+    # Limpieza de JSON (Markdown fix)
+    if content.startswith("```json"): content = content[7:-3].strip()
+    if content.startswith("```"): content = content[3:-3].strip()
+
+    return json.loads(content)
@@ -0,0 +1,192 @@
+"""
+Serialización rápida de respuestas grandes, compresión negociada y ETags.
+
+`/chat` y `/refine` devuelven la spec, el plan y todos los ficheros generados:
+varios MB de JSON por respuesta. Aquí:
+
+- el JSON se codifica con orjson si está instalado (json estándar compacto si no);
+- el cuerpo se comprime según `Accept-Encoding` (brotli si el paquete `brotli`
+  está instalado, si no gzip) a partir de COMPRESS_MIN_BYTES;
+- cada cuerpo lleva un ETag débil derivado del hash de su contenido; en GET/HEAD,
+  si el cliente reenvía `If-None-Match` con el mismo valor recibe un 304 sin
+  cuerpo. RFC 9110 solo permite 304 para GET/HEAD, así que los POST (/chat,
+  /refine) ignoran `If-None-Match`: para revalidar una generación cacheada se
+  usa `GET /chat/results/{id}` (cabecera `Content-Location` de /chat);
+- las respuestas que se cachean se codifican una sola vez (`encode_json`): la
+  caché guarda el cuerpo ya comprimido con gzip junto a su ETag y los aciertos
+  se sirven desde esos bytes, sin decodificar, recodificar ni recalcular el
+  hash (solo se descomprime si el cliente no acepta gzip).
+
+Variables de entorno:
+- COMPRESS_MIN_BYTES=1024   tamaño mínimo (sin comprimir) para comprimir
+- GZIP_LEVEL=5
+- BROTLI_QUALITY=5
+"""
+
+import os
+import gzip
+import json
+import asyncio
+import hashlib
+from typing import Any, Dict, NamedTuple, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depende del entorno
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# Por encima de este tamaño la compresión sale del event loop
+OFFLOAD_BYTES = 256 * 1024
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON encoding (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def content_etag(body: bytes) -> str:
+    # Débil: el mismo contenido puede servirse con distintas codificaciones
+    return 'W/"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Comparación débil: se ignora el prefijo W/
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def _accepted_codings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    if not accept_encoding:
+        return accepted
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    return accepted
+
+
+def accepts(accept_encoding: Optional[str], coding: str) -> bool:
+    accepted = _accepted_codings(accept_encoding)
+    return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best supported content coding for an `Accept-Encoding` header ("br", "gzip" or None)."""
+    accepted = _accepted_codings(accept_encoding)
+    if not accepted:
+        return None
+
+    def weight(coding: str) -> float:
+        return accepted.get(coding, accepted.get("*", 0.0))
+
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best = max(candidates, key=lambda c: (weight(c), c == "br"))
+    return best if weight(best) > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0: la misma entrada produce siempre los mismos bytes
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class EncodedJSON(NamedTuple):
+    """A JSON body ready to send (gzip-compressed when `encoding` is "gzip") and its ETag."""
+    body: bytes
+    etag: str
+    encoding: Optional[str] = None
+
+    def pack(self) -> bytes:
+        """Single bytes value for caches: ETag and encoding lines, then the body."""
+        return f"{self.etag}\n{self.encoding or ''}\n".encode("ascii") + self.body
+
+    @classmethod
+    def unpack(cls, raw: bytes) -> "EncodedJSON":
+        etag, encoding, body = raw.split(b"\n", 2)
+        return cls(body, etag.decode("ascii"), encoding.decode("ascii") or None)
+
+    def json_bytes(self) -> bytes:
+        """The uncompressed JSON."""
+        return gzip.decompress(self.body) if self.encoding == "gzip" else self.body
+
+
+def encode_json(payload: Any) -> EncodedJSON:
+    """Encode once for storage: JSON, its ETag and gzip from COMPRESS_MIN_BYTES on."""
+    body = dumps(payload)
+    etag = content_etag(body)
+    if len(body) >= COMPRESS_MIN_BYTES:
+        return EncodedJSON(compress(body, "gzip"), etag, "gzip")
+    return EncodedJSON(body, etag)
+
+
+async def _offload(func, body: bytes, *args) -> bytes:
+    if len(body) >= OFFLOAD_BYTES:
+        return await asyncio.to_thread(func, body, *args)
+    return func(body, *args)
+
+
+async def encoded_response(request: Request, encoded: EncodedJSON, status_code: int = 200,
+                           headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Send an already encoded JSON body, answering 304 to a GET/HEAD when the
+    client already has it. Gzip bodies go out as they are unless the client
+    does not accept gzip; plain ones are compressed per `Accept-Encoding`.
+    """
+    headers = {**(headers or {}), "ETag": encoded.etag, "Vary": "Accept-Encoding"}
+
+    if request.method in ("GET", "HEAD") and etag_matches(request.headers.get("if-none-match"), encoded.etag):
+        return Response(status_code=304, headers=headers)
+
+    accept_encoding = request.headers.get("accept-encoding")
+    body, encoding = encoded.body, encoded.encoding
+    if encoding == "gzip" and not accepts(accept_encoding, "gzip"):
+        body, encoding = await _offload(gzip.decompress, body), None
+    elif encoding is None and len(body) >= COMPRESS_MIN_BYTES:
+        encoding = choose_encoding(accept_encoding)
+        if encoding:
+            body = await _offload(compress, body, encoding)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+
+async def json_response(request: Request, payload: Any, status_code: int = 200,
+                        headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Encode `payload` as JSON with a content-hash ETag, answering 304 to a
+    GET/HEAD when the client already has it and compressing according to
+    `Accept-Encoding`.
+    """
+    body = dumps(payload)
+    return await encoded_response(request, EncodedJSON(body, content_etag(body)), status_code, headers)
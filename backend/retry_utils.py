@@ -1,7 +1,14 @@
+import time
 import logging
-from typing import Any, List
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from langchain_core.messages import BaseMessage
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, List, Optional
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, retry_if_not_exception_type
+from langchain_core.messages import AIMessage, BaseMessage
+from . import llm_budget
+from . import tracing
+from .cassette import invoke_with_cassette, model_name
 
 try:
     # google.api_core is used by langchain-google-genai exceptions
@@ -13,6 +20,23 @@ except Exception as e:
 
 logger = logging.getLogger(__name__)
 
+# Evento de cancelación de las llamadas del hilo actual (trabajo especulativo, ver speculation.py)
+_CANCEL_EVENT: ContextVar[Optional[threading.Event]] = ContextVar("aegis_llm_cancel", default=None)
+
+
+class InvokeCancelled(Exception):
+    """The LLM call was abandoned because its cancellation event was set."""
+
+
+@contextmanager
+def cancellable(event: threading.Event):
+    """Make the LLM calls inside this block stop as soon as `event` is set."""
+    token = _CANCEL_EVENT.set(event)
+    try:
+        yield
+    finally:
+        _CANCEL_EVENT.reset(token)
+
 
 def _log_retry(retry_state):
     logger.warning(
@@ -30,13 +54,58 @@ def _default_stop():
     return stop_after_attempt(3)
 
 
+def _traced_sleep(seconds: float):
+    # Las esperas de backoff aparecen como spans propios en la traza
+    with tracing.span("llm.backoff_sleep", seconds=round(seconds, 3)):
+        time.sleep(seconds)
+
+
+def _call_model(model: Any, messages: List[BaseMessage]):
+    event = _CANCEL_EVENT.get()
+    if event is None:
+        return model.invoke(messages)
+    if event.is_set():
+        raise InvokeCancelled()
+    # Cancelable: se consume en streaming y se corta entre fragmentos (cerrar el
+    # generador cierra la respuesta del proveedor)
+    response = None
+    stream = model.stream(messages)
+    try:
+        for chunk in stream:
+            if event.is_set():
+                raise InvokeCancelled()
+            response = chunk if response is None else response + chunk
+    finally:
+        stream.close()
+    return response if response is not None else AIMessage(content="")
+
+
 @retry(
     wait=_default_wait(),
     stop=_default_stop(),
-    retry=retry_if_exception_type(RETRIABLE_EXCEPTIONS),
+    retry=retry_if_exception_type(RETRIABLE_EXCEPTIONS) & retry_if_not_exception_type(InvokeCancelled),
     reraise=True,
     after=_log_retry,
+    sleep=_traced_sleep,
 )
+def _invoke_with_backoff(model: Any, messages: List[BaseMessage]):
+    # Cada intento es un span independiente (el decorador re-ejecuta este cuerpo)
+    with tracing.span("llm.attempt", model=model_name(model), messages=len(messages)) as s:
+        try:
+            response = _call_model(model, messages)
+        except Exception:
+            # Uso desconocido (error o llamada cortada): la reserva no se reduce
+            llm_budget.record_usage(None)
+            raise
+        usage = getattr(response, "usage_metadata", None)
+        llm_budget.record_usage(usage)
+        if s is not None and usage:
+            s.set_attribute("input_tokens", usage.get("input_tokens", 0))
+            s.set_attribute("output_tokens", usage.get("output_tokens", 0))
+        return response
+
+
 def invoke_with_retry(model: Any, messages: List[BaseMessage]):
     """Invoke LangChain chat model with retries and exponential backoff."""
-    return model.invoke(messages)
+    # En modo cassette la llamada se graba o se sirve desde el fichero (ver cassette.py)
+    return invoke_with_cassette(model, messages, _invoke_with_backoff, not_recorded=(InvokeCancelled,))
@@ -0,0 +1,287 @@
+"""
+Rate limiting compartido entre workers de Uvicorn + presupuesto global de tokens.
+
+Los contadores de slowapi viven por defecto en memoria de cada proceso: con N
+workers un cliente obtiene N veces el límite. Aquí los contadores se guardan en
+un almacén compartido con la interfaz de Redis (INCRBY / EXPIRE / GET / PTTL /
+DEL), de modo que:
+
+- `SQLiteCounterStore` es el sustituto local (un fichero SQLite en el host,
+  compartido por todos los workers) y no necesita servicios externos.
+- Un cliente `redis.Redis` real cumple la misma interfaz para varios hosts.
+
+`TokenBudget` aplica un límite global de tokens LLM por minuto sobre el mismo
+almacén, para rechazar peticiones *antes* de lanzar el grafo (admission control).
+La instancia del proceso y la corrección de cada reserva con el uso real
+están en llm_budget.py.
+
+Variables de entorno:
+- RATE_LIMIT_STORAGE_URI   sqlite:///ruta.db (por defecto en el tmp del host) | redis://host:6379/0 | memory://
+- LLM_TOKENS_PER_MINUTE=0  presupuesto global de tokens por minuto (0 = desactivado)
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORAGE_URI = "sqlite://" + os.path.join(tempfile.gettempdir(), "aegis_ratelimit.db")
+
+
+def storage_uri() -> str:
+    return os.getenv("RATE_LIMIT_STORAGE_URI", DEFAULT_STORAGE_URI)
+
+
+class SQLiteCounterStore:
+    """
+    Local stand-in for the subset of Redis commands used by the limiter.
+
+    Every worker process opens the same SQLite file; writes run inside
+    `BEGIN IMMEDIATE` transactions so increments are atomic across processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Una conexión por proceso (los workers pueden crearse por fork)
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL)"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _write(self, fn):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, time.time())
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _read(self, key: str) -> Optional[Tuple[int, Optional[float]]]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM counters WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row
+
+    def incrby(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """
+        INCRBY; with `ttl`, a newly created key gets that expiry in the same
+        transaction (an existing key keeps its own).
+        """
+        def op(conn, now):
+            conn.execute("DELETE FROM counters WHERE key = ? AND expires_at <= ?", (key, now))
+            conn.execute(
+                "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+                (key, amount, now + ttl if ttl is not None else None),
+            )
+            return conn.execute("SELECT value FROM counters WHERE key = ?", (key,)).fetchone()[0]
+        return self._write(op)
+
+    def expire(self, key: str, seconds: float) -> bool:
+        def op(conn, now):
+            cur = conn.execute("UPDATE counters SET expires_at = ? WHERE key = ?", (now + seconds, key))
+            return cur.rowcount > 0
+        return self._write(op)
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._read(key)
+        return str(row[0]) if row else None
+
+    def pttl(self, key: str) -> int:
+        """Milliseconds to expiry; -2 if the key does not exist, -1 if it never expires."""
+        row = self._read(key)
+        if row is None:
+            return -2
+        if row[1] is None:
+            return -1
+        return max(0, int((row[1] - time.time()) * 1000))
+
+    def delete(self, *keys: str) -> int:
+        def op(conn, now):
+            return sum(conn.execute("DELETE FROM counters WHERE key = ?", (k,)).rowcount for k in keys)
+        return self._write(op)
+
+    def update(self, key: str, fn: Callable[[Optional[str]], Optional[str]],
+               ttl: Optional[float] = None) -> Optional[str]:
+        """
+        Replace the string at `key` with `fn(current)` in one transaction
+        (None deletes it); the new value expires after `ttl` seconds.
+        """
+        def op(conn, now):
+            row = conn.execute("SELECT value, expires_at FROM counters WHERE key = ?", (key,)).fetchone()
+            value = fn(str(row[0]) if row and (row[1] is None or row[1] > now) else None)
+            if value is None:
+                conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+            else:
+                # Los valores de texto (JSON) conviven con los contadores: SQLite guarda el tipo de cada valor
+                conn.execute(
+                    "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                    (key, value, now + ttl if ttl is not None else None),
+                )
+            return value
+        return self._write(op)
+
+    def delete_prefix(self, prefix: str) -> int:
+        def op(conn, now):
+            return conn.execute("DELETE FROM counters WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)).rowcount
+        return self._write(op)
+
+    def flushdb(self) -> bool:
+        self._write(lambda conn, now: conn.execute("DELETE FROM counters"))
+        return True
+
+    def ping(self) -> bool:
+        with self._lock:
+            self._connection().execute("SELECT 1")
+        return True
+
+
+# INCRBY + EXPIRE del primer hit en un solo paso atómico (Redis ejecuta el script entero)
+_INCR_WITH_TTL_LUA = """
+local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+if value == tonumber(ARGV[1]) then redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+return value
+"""
+
+
+def incr_with_ttl(client: Any, key: str, amount: int, ttl: int) -> int:
+    """
+    Atomically increment `key` and set its expiry when the increment created it,
+    so a worker dying in between can never leave a counter without expiry.
+    """
+    if isinstance(client, SQLiteCounterStore):
+        return client.incrby(key, amount, ttl)
+    return int(client.eval(_INCR_WITH_TTL_LUA, 1, key, amount, ttl))
+
+
+def update_value(client: Any, key: str, fn: Callable[[Optional[str]], Optional[str]],
+                 ttl: Optional[int] = None) -> Optional[str]:
+    """
+    Atomic read-modify-write of a string value shared by every worker.
+
+    `fn` receives the current value (None if missing) and returns the new one
+    (None deletes the key). On Redis it runs under WATCH/MULTI and may be
+    called again if another worker wrote the key meanwhile.
+    """
+    if isinstance(client, SQLiteCounterStore):
+        return client.update(key, fn, ttl)
+
+    def transaction(pipe):
+        value = fn(pipe.get(key))
+        pipe.multi()
+        if value is None:
+            pipe.delete(key)
+        else:
+            pipe.set(key, value, ex=ttl)
+        return value
+    return client.transaction(transaction, key, value_from_callable=True)
+
+
+def delete_prefix(client: Any, prefix: str) -> int:
+    """Delete every key starting with `prefix`."""
+    if isinstance(client, SQLiteCounterStore):
+        return client.delete_prefix(prefix)
+    keys = list(client.scan_iter(match=prefix + "*"))
+    return client.delete(*keys) if keys else 0
+
+
+def counter_client_from_uri(uri: str) -> Any:
+    """Build a Redis-compatible counter client for `uri`."""
+    scheme, _, rest = uri.partition("://")
+    if scheme == "memory":
+        return SQLiteCounterStore(":memory:")
+    if scheme == "sqlite":
+        return SQLiteCounterStore(rest or ":memory:")
+    if scheme in ("redis", "rediss"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_STORAGE_URI uses Redis but the 'redis' package is not installed") from e
+        return redis.Redis.from_url(uri, decode_responses=True)
+    raise ValueError(f"Unsupported counter storage URI: {uri}")
+
+
+class TokenBudget:
+    """
+    Global outbound LLM tokens-per-minute budget shared by every worker.
+
+    Requests reserve their estimated tokens in the current one-minute window
+    before the graph runs; if the window is full they are rejected with the
+    seconds left until it resets.
+    """
+
+    def __init__(self, client: Any, tokens_per_minute: int, key_prefix: str = "aegis:llm_tpm"):
+        self.client = client
+        self.tokens_per_minute = tokens_per_minute
+        self.key_prefix = key_prefix
+
+    @classmethod
+    def from_env(cls, uri: Optional[str] = None) -> "TokenBudget":
+        tpm = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+        # Sin presupuesto no hace falta tocar el almacén
+        client = counter_client_from_uri(uri or storage_uri()) if tpm > 0 else None
+        return cls(client, tpm)
+
+    @property
+    def enabled(self) -> bool:
+        return self.tokens_per_minute > 0 and self.client is not None
+
+    def _window(self) -> Tuple[str, float]:
+        now = time.time()
+        return f"{self.key_prefix}:{int(now // 60)}", 60 - (now % 60)
+
+    def try_acquire(self, tokens: int) -> Tuple[bool, float]:
+        """Reserve `tokens`; returns (admitted, retry_after_seconds)."""
+        reserved, retry_after = self.reserve(tokens)
+        return reserved is not None, retry_after
+
+    def reserve(self, tokens: int) -> Tuple[Optional[Tuple[str, int]], float]:
+        """Reserve `tokens`; returns ((window_key, tokens_reserved) or None if rejected, retry_after)."""
+        if not self.enabled:
+            return ("", 0), 0.0
+        # Una petición mayor que el presupuesto entero solo cabe en una ventana vacía
+        tokens = max(1, min(int(tokens), self.tokens_per_minute))
+        key, retry_after = self._window()
+        used = incr_with_ttl(self.client, key, tokens, 120)
+        if used > self.tokens_per_minute:
+            self.client.incrby(key, -tokens)
+            return None, retry_after
+        return (key, tokens), 0.0
+
+    def adjust(self, key: str, delta: int):
+        """Correct a reservation made in window `key` by `delta` tokens (see llm_budget.py)."""
+        if self.enabled and key and delta:
+            incr_with_ttl(self.client, key, int(delta), 120)
+
+    def usage(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        key, reset_in = self._window()
+        used = int(self.client.get(key) or 0)
+        return {"enabled": True, "tokens_per_minute": self.tokens_per_minute,
+                "used": used, "reset_in_s": round(reset_in, 1)}
@@ -0,0 +1,282 @@
+"""
+Pipeline especulativo (opt-in): solapar Visionario, Arquitecto y Constructor.
+
+El grafo es secuencial (visionary → architect → constructor), pero el
+Arquitecto solo lee `spec_document`. Con SPECULATIVE_PIPELINE=1 el Visionario
+hace streaming de la spec y, en cuanto el texto parcial es "estable", lanza el
+Arquitecto en segundo plano sobre esa spec parcial. Cuando ese plan termina se
+lanza también el Constructor. Mientras la spec sigue creciendo, la
+especulación se relanza cada vez que el texto crece un factor
+SPECULATIVE_REGROW (hasta SPECULATIVE_MAX_LAUNCHES veces) y la anterior se
+descarta. Al acabar el streaming:
+
+- si la spec final no difiere materialmente de la parcial (la parcial está
+  contenida en la final y cubre al menos SPECULATIVE_MIN_COVERAGE de su
+  longitud, es decir, solo falta una cola corta), los nodos
+  architect/constructor reutilizan los resultados;
+- si difiere, se descartan y los nodos se ejecutan normalmente.
+
+Descartar una especulación la cancela de verdad: sus llamadas al modelo corren
+bajo `retry_utils.cancellable`, que las consume en streaming y las corta en
+cuanto se activa el evento, y el Constructor ya no se lanza. Cada lanzamiento
+reserva tokens en el presupuesto global (`llm_budget.budget()`), que se corrigen
+con el uso real al terminar; si no caben, no se especula.
+
+El Constructor genera todo el código en una sola llamada sobre el plan
+completo, así que su arranque temprano es a nivel de plan (cuando el plan
+especulativo está completo), no por tarea.
+
+Variables de entorno:
+- SPECULATIVE_PIPELINE=0|1
+- SPECULATIVE_MIN_CHARS=1200      longitud mínima de la spec parcial
+- SPECULATIVE_MIN_SECTIONS=3      encabezados Markdown mínimos en la spec parcial
+- SPECULATIVE_SIMILARITY=0.9      fracción mínima de palabras de la parcial presentes en la final
+- SPECULATIVE_MIN_COVERAGE=0.9    longitud mínima de la parcial respecto a la final
+- SPECULATIVE_REGROW=1.4          crecimiento de la spec que provoca un relanzamiento
+- SPECULATIVE_MAX_LAUNCHES=3      lanzamientos máximos por petición
+- SPECULATIVE_WORKERS=4
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.messages.ai import add_usage
+from . import llm_budget
+from . import tracing
+from .speculation_state import Speculation, SpeculationStats
+from .retry_utils import InvokeCancelled, cancellable
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_PIPELINE = os.getenv("SPECULATIVE_PIPELINE", "0") == "1"
+SPECULATIVE_MIN_CHARS = int(os.getenv("SPECULATIVE_MIN_CHARS", "1200"))
+SPECULATIVE_MIN_SECTIONS = int(os.getenv("SPECULATIVE_MIN_SECTIONS", "3"))
+SPECULATIVE_SIMILARITY = float(os.getenv("SPECULATIVE_SIMILARITY", "0.9"))
+SPECULATIVE_MIN_COVERAGE = float(os.getenv("SPECULATIVE_MIN_COVERAGE", "0.9"))
+SPECULATIVE_REGROW = float(os.getenv("SPECULATIVE_REGROW", "1.4"))
+SPECULATIVE_MAX_LAUNCHES = int(os.getenv("SPECULATIVE_MAX_LAUNCHES", "3"))
+
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPECULATIVE_WORKERS", "4")),
+    thread_name_prefix="aegis-speculation",
+)
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+STATS = SpeculationStats(lambda: SPECULATIVE_PIPELINE)
+
+# Especulaciones pendientes por request_id (acotado por si algún nodo no las recoge)
+_PENDING: "OrderedDict[str, Speculation]" = OrderedDict()
+_PENDING_SIZE = 64
+_PENDING_LOCK = threading.Lock()
+
+
+def spec_is_stable(text: str) -> bool:
+    """Heuristic: long enough and with several Markdown sections."""
+    return (
+        len(text) >= SPECULATIVE_MIN_CHARS
+        and text.count("\n#") + text.startswith("#") >= SPECULATIVE_MIN_SECTIONS
+    )
+
+
+def materially_same(partial: str, final: str) -> bool:
+    """
+    The partial spec is (almost) contained in the final one and covers most of it.
+
+    Containment (share of the partial's words present in the final) does not
+    penalise a prefix for being shorter; the coverage check rejects prefixes
+    that miss most of the final spec.
+    """
+    if not final:
+        return not partial
+    if len(partial) / len(final) < SPECULATIVE_MIN_COVERAGE:
+        return False
+    a = set(_WORD_RE.findall(partial.lower()))
+    b = set(_WORD_RE.findall(final.lower()))
+    if not a:
+        return True
+    return len(a & b) / len(a) >= SPECULATIVE_SIMILARITY
+
+
+def plan_digest(plan: Any) -> str:
+    return hashlib.sha256(json.dumps(plan, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _submit(fn, *args) -> Future:
+    # Los hilos heredan el contexto para que sus spans cuelguen de la petición
+    ctx = contextvars.copy_context()
+    return _EXECUTOR.submit(ctx.run, fn, *args)
+
+
+def _start(request_id: str, partial_spec: str, messages: List[BaseMessage], vaccines: List[str],
+           template_id: str = "") -> bool:
+    """Launch speculation on `partial_spec`; False if the token budget has no room for it."""
+    from .agent_architect import architect_agent
+    from .agent_constructor import ConstructorAgent
+
+    # Las llamadas especulativas gastan cuota real: reservan como una ejecución del grafo
+    reservation, _ = llm_budget.reserve(llm_budget.estimate_request_tokens(partial_spec))
+    if reservation is None:
+        STATS.incr("budget_denied")
+        tracing.add_event("speculation.budget_denied", spec_chars=len(partial_spec))
+        return False
+
+    speculation = Speculation(partial_spec)
+    with _PENDING_LOCK:
+        previous = _PENDING.pop(request_id, None)
+        _PENDING[request_id] = speculation
+        while len(_PENDING) > _PENDING_SIZE:
+            _PENDING.popitem(last=False)
+    if previous is not None:
+        # Relanzamiento sobre una spec más larga: la especulación anterior se descarta
+        previous.discard()
+        STATS.incr("relaunched")
+        STATS.incr("architect_wasted")
+        if previous.code is not None:
+            STATS.incr("constructor_wasted")
+
+    def run_constructor(plan):
+        # Si se cancela, InvokeCancelled queda en el future, que ya nadie reutiliza
+        with tracing.span("speculation.constructor"), cancellable(speculation.cancelled):
+            return llm_budget.run_charged(reservation, ConstructorAgent().generate_code, plan, partial_spec,
+                                          vaccines, messages + [AIMessage(content=partial_spec)], template_id)
+
+    def run_architect():
+        # Sin request_id: el nodo no debe buscar su propia especulación
+        state = {"spec_document": partial_spec, "template_id": template_id}
+        plan = []
+        try:
+            with tracing.span("speculation.architect", spec_chars=len(partial_spec)), \
+                    cancellable(speculation.cancelled), llm_budget.charging(reservation):
+                plan = architect_agent(state).get("current_plan", [])
+        except InvokeCancelled:
+            tracing.add_event("speculation.cancelled", stage="architect")
+        finally:
+            # Si la especulación ya se descartó, no merece la pena lanzar el Constructor
+            if plan and not speculation.cancelled.is_set():
+                speculation.plan_digest = plan_digest(plan)
+                STATS.incr("constructor_started")
+                speculation.code = _submit(run_constructor, plan)
+            else:
+                # Sin Constructor, la reserva se corrige ya con lo que gastó el Arquitecto
+                reservation.settle()
+        return plan
+
+    STATS.incr("architect_started")
+    speculation.plan = _submit(run_architect)
+    return True
+
+
+def stream_spec(llm: Any, model_messages: List[BaseMessage], state: Dict[str, Any], request_id: str) -> AIMessage:
+    """
+    Stream the Visionary response and launch the Architect speculatively once
+    the partial spec is stable. Returns the complete response message.
+    """
+    base_messages = [m for m in state.get("messages", []) if m.content and str(m.content).strip()]
+    vaccines = state.get("security_vaccines", [])
+    text = ""
+    usage = None
+    launches = 0
+    # Longitud que debe alcanzar la spec para el siguiente lanzamiento
+    next_launch_at = SPECULATIVE_MIN_CHARS
+
+    try:
+        with tracing.span("llm.stream", role="visionary"):
+            for chunk in llm.stream(model_messages):
+                if chunk.usage_metadata:
+                    usage = add_usage(usage, chunk.usage_metadata)
+                piece = chunk.content
+                text += piece if isinstance(piece, str) else "".join(str(p) for p in piece)
+                if launches < SPECULATIVE_MAX_LAUNCHES and len(text) >= next_launch_at:
+                    # Solo se especula sobre líneas completas
+                    partial = text[:text.rfind("\n") + 1]
+                    if len(partial) >= next_launch_at and spec_is_stable(partial):
+                        next_launch_at = int(len(partial) * SPECULATIVE_REGROW)
+                        if not _start(request_id, partial, base_messages, vaccines, state.get("template_id", "")):
+                            # Sin presupuesto no se insiste en esta petición
+                            next_launch_at = float("inf")
+                            continue
+                        launches += 1
+                        tracing.add_event("speculation.start", spec_chars=len(partial), launch=launches)
+    except Exception:
+        # Stream cortado: uso desconocido, la reserva de la petición no se reduce
+        llm_budget.record_usage(None)
+        raise
+
+    # La llamada en streaming no pasa por retry_utils: su uso se carga aquí
+    llm_budget.record_usage(usage)
+    if not launches:
+        STATS.incr("not_started")
+    return AIMessage(content=text, usage_metadata=usage)
+
+
+def _take(request_id: Optional[str]) -> Optional[Speculation]:
+    if not request_id:
+        return None
+    with _PENDING_LOCK:
+        return _PENDING.get(request_id)
+
+
+def take_plan(request_id: Optional[str], final_spec: str) -> Optional[List[Dict[str, Any]]]:
+    """Speculative plan for this request if the final spec did not change materially."""
+    speculation = _take(request_id)
+    if speculation is None:
+        return None
+
+    if not materially_same(speculation.partial_spec, final_spec):
+        # La cola que falta es demasiado larga: se corta el trabajo en curso
+        speculation.discard()
+        STATS.incr("architect_wasted")
+        with _PENDING_LOCK:
+            _PENDING.pop(request_id, None)
+        if speculation.code is not None:
+            STATS.incr("constructor_wasted")
+        tracing.add_event("speculation.wasted", stage="architect")
+        return None
+
+    try:
+        plan = speculation.plan.result()
+    except Exception as e:
+        logger.warning("Speculative architect failed: %s", e)
+        plan = None
+    if not plan:
+        STATS.incr("architect_wasted")
+        return None
+    STATS.incr("architect_reused")
+    tracing.add_event("speculation.reused", stage="architect")
+    return plan
+
+
+def take_code(request_id: Optional[str], plan: Any) -> Optional[Dict[str, Any]]:
+    """Speculative Constructor result if it was generated from this exact plan."""
+    speculation = _take(request_id)
+    if speculation is None:
+        return None
+    with _PENDING_LOCK:
+        _PENDING.pop(request_id, None)
+    if speculation.code is None:
+        return None
+
+    if speculation.plan_digest != plan_digest(plan):
+        STATS.incr("constructor_wasted")
+        tracing.add_event("speculation.wasted", stage="constructor")
+        return None
+    try:
+        result = speculation.code.result()
+    except Exception as e:
+        logger.warning("Speculative constructor failed: %s", e)
+        STATS.incr("constructor_wasted")
+        return None
+    STATS.incr("constructor_reused")
+    tracing.add_event("speculation.reused", stage="constructor")
+    return result
@@ -0,0 +1,55 @@
+"""
+Estado del pipeline especulativo (ver speculation.py): contadores que expone
+`GET /stats` y el trabajo lanzado para una petición.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+
+class SpeculationStats:
+    """Counters of speculative work started, reused and wasted per stage."""
+
+    STAGES = ("architect", "constructor")
+
+    def __init__(self, enabled: Callable[[], bool]):
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._counts = {f"{stage}_{event}": 0 for stage in self.STAGES
+                        for event in ("started", "reused", "wasted")}
+        self._counts["not_started"] = 0
+        self._counts["relaunched"] = 0
+        self._counts["budget_denied"] = 0
+
+    def incr(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        for stage in self.STAGES:
+            decided = counts[f"{stage}_reused"] + counts[f"{stage}_wasted"]
+            counts[f"{stage}_waste_ratio"] = round(counts[f"{stage}_wasted"] / decided, 3) if decided else 0.0
+        counts["enabled"] = self._enabled()
+        return counts
+
+
+class Speculation:
+    """Speculative work launched for one request."""
+
+    def __init__(self, partial_spec: str):
+        self.partial_spec = partial_spec
+        self.plan: Optional[Future] = None
+        self.code: Optional[Future] = None
+        self.plan_digest: Optional[str] = None
+        # Lo comprueban los hilos especulativos (y sus llamadas al modelo)
+        self.cancelled = threading.Event()
+
+    def discard(self):
+        """Stop the speculative work: queued futures never start, running calls are cut."""
+        self.cancelled.set()
+        for future in (self.plan, self.code):
+            if future is not None:
+                future.cancel()
@@ -1,3 +1,4 @@
+import operator
 from typing import List, TypedDict, Annotated
 from langchain_core.messages import BaseMessage
 
@@ -20,3 +21,5 @@ class ProjectState(TypedDict):
     security_vaccines: List[str]# Context injected by Scribe
     retry_count: int            # For HITL trigger
     build_status: str           # "clean", "vulnerable", "broken"
+    request_id: str             # Correlates graph nodes with the request trace
+    template_id: str            # Closest precomputed template (warm start), "" if none
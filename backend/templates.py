@@ -0,0 +1,296 @@
+"""
+Biblioteca de plantillas precalculadas para arranque en caliente.
+
+Buena parte del tráfico de /chat son variaciones de una docena de arquetipos
+(app de tareas, dashboard SaaS, API REST con auth...). La spec, el plan y los
+ficheros base de cada arquetipo se generan offline con el propio grafo y se
+guardan como JSON en TEMPLATE_DIR. En /chat se busca la plantilla más cercana
+al mensaje (solo al empezar una conversación, nunca en los turnos siguientes
+de un hilo) y su id viaja en `ProjectState.template_id`:
+
+- el Arquitecto parte del plan de la plantilla y solo lo adapta;
+- el Constructor recibe los ficheros de la plantilla y devuelve los ficheros
+  nuevos o modificados (el delta) y la lista de ficheros base que conserva;
+  el resultado es el delta más esos ficheros conservados.
+
+Para casar hace falta al menos una palabra clave fuerte: las débiles solo
+suman puntos. Se evitan palabras ambiguas en español (p. ej. "todo", que
+casi siempre significa "all").
+
+Uso:
+    python -m backend.templates build                  # genera las que falten
+    python -m backend.templates build --only todo-app --force
+    python -m backend.templates list
+    python -m backend.templates match "Una API REST con login JWT"
+
+Variables de entorno:
+- TEMPLATES=1 | 0                    activa el arranque en caliente
+- TEMPLATE_DIR=backend/template_library
+- TEMPLATE_MIN_SCORE=2               puntuación mínima de palabras clave
+- TEMPLATE_CONTEXT_MAX_CHARS=60000   contenido de ficheros base enviado al Constructor
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_ENABLED = os.getenv("TEMPLATES", "1") != "0"
+TEMPLATE_MIN_SCORE = int(os.getenv("TEMPLATE_MIN_SCORE", "2"))
+TEMPLATE_CONTEXT_MAX_CHARS = int(os.getenv("TEMPLATE_CONTEXT_MAX_CHARS", "60000"))
+
+
+def template_dir() -> str:
+    return os.getenv("TEMPLATE_DIR", "") or os.path.join(os.path.dirname(__file__), "template_library")
+
+
+# Arquetipos frecuentes: prompt canónico + palabras clave (normalizadas, sin acentos).
+# Las fuertes puntúan 2 y las débiles 1; sin ninguna fuerte no hay coincidencia.
+# Nada de palabras ambiguas en español como fuertes ("todo", "citas", "tablero"...).
+ARCHETYPES: List[Dict[str, Any]] = [
+    {"id": "todo-app", "title": "Todo app",
+     "prompt": "Una aplicación de tareas (todo list) con usuarios, listas, fechas límite y filtros por estado.",
+     "strong": ["todo list", "todo app", "to-do", "lista de tareas", "gestor de tareas", "app de tareas",
+                "tareas pendientes", "task list", "task manager"],
+     "weak": ["tareas", "checklist", "recordatorios"]},
+    {"id": "saas-dashboard", "title": "SaaS dashboard",
+     "prompt": "Un dashboard SaaS multi-tenant con login, métricas con gráficos, gestión de equipo y facturación por suscripción.",
+     "strong": ["saas", "dashboard", "panel de control"], "weak": ["metricas", "graficos", "suscripcion", "tenant", "analytics", "kpi"]},
+    {"id": "rest-api-auth", "title": "REST API with auth",
+     "prompt": "Una API REST con registro, login con JWT, refresh tokens, roles y CRUD de recursos protegido.",
+     "strong": ["api rest", "rest api", "jwt"], "weak": ["api", "auth", "login", "autenticacion", "backend", "tokens", "endpoints"]},
+    {"id": "landing-page", "title": "Landing page",
+     "prompt": "Una landing page de producto con hero, características, precios, testimonios y formulario de contacto.",
+     "strong": ["landing", "pagina de aterrizaje"], "weak": ["hero", "precios", "pricing", "testimonios", "marketing", "newsletter"]},
+    {"id": "blog-cms", "title": "Blog / CMS",
+     "prompt": "Un blog con CMS: posts en Markdown, categorías, etiquetas, comentarios y panel de edición.",
+     "strong": ["blog", "cms"], "weak": ["posts", "articulos", "comentarios", "markdown", "editor"]},
+    {"id": "ecommerce-store", "title": "E-commerce store",
+     "prompt": "Una tienda online con catálogo, carrito, checkout con Stripe, pedidos y panel de administración.",
+     "strong": ["ecommerce", "e-commerce", "tienda online", "carrito"], "weak": ["tienda", "checkout", "productos", "stripe", "pedidos", "shop"]},
+    {"id": "chat-app", "title": "Realtime chat",
+     "prompt": "Una app de chat en tiempo real con salas, mensajes directos, presencia y notificaciones (WebSockets).",
+     "strong": ["chat en tiempo real", "mensajeria", "websocket", "websockets"], "weak": ["chat", "salas", "mensajes", "realtime", "tiempo real"]},
+    {"id": "crud-admin", "title": "CRUD admin panel",
+     "prompt": "Un panel de administración CRUD con tablas paginadas, formularios validados, búsqueda y control de acceso.",
+     "strong": ["crud", "backoffice", "panel de administracion", "admin panel"], "weak": ["admin", "tablas", "formularios", "inventario"]},
+    {"id": "portfolio", "title": "Portfolio site",
+     "prompt": "Un portfolio personal con proyectos, sobre mí, CV descargable y formulario de contacto.",
+     "strong": ["portfolio", "portafolio"], "weak": ["cv", "curriculum", "proyectos"]},
+    {"id": "booking-system", "title": "Booking system",
+     "prompt": "Un sistema de reservas con calendario de disponibilidad, citas, recordatorios por email y pagos.",
+     "strong": ["reservas", "booking", "sistema de citas", "appointments"], "weak": ["citas", "agenda", "calendario", "disponibilidad", "turnos"]},
+    {"id": "expense-tracker", "title": "Expense tracker",
+     "prompt": "Un gestor de gastos personales con categorías, presupuestos mensuales, gráficos e importación CSV.",
+     "strong": ["gastos", "expense", "finanzas personales"], "weak": ["presupuesto", "ingresos", "finanzas", "csv", "budget"]},
+    {"id": "kanban-board", "title": "Kanban board",
+     "prompt": "Un tablero Kanban colaborativo con columnas, tarjetas arrastrables, asignaciones y comentarios.",
+     "strong": ["kanban", "trello"], "weak": ["tablero", "columnas", "tarjetas", "drag", "arrastrar", "sprint"]},
+]
+
+_ARCHETYPES_BY_ID = {a["id"]: a for a in ARCHETYPES}
+
+_LIBRARY: Optional[Dict[str, Dict[str, Any]]] = None
+_LIBRARY_LOCK = threading.Lock()
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and collapse everything but words into single spaces."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " " + " ".join(re.findall(r"[a-z0-9]+(?:-[a-z0-9]+)*", text)) + " "
+
+
+def score(message: str, archetype: Dict[str, Any]) -> int:
+    """Keyword score; 0 unless at least one strong keyword is present."""
+    text = normalize(message)
+    strong = sum(1 for kw in archetype["strong"] if normalize(kw) in text)
+    if not strong:
+        return 0
+    return 2 * strong + sum(1 for kw in archetype["weak"] if normalize(kw) in text)
+
+
+def load_library(refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+    """Built templates on disk, by id (cached in memory after the first read)."""
+    global _LIBRARY
+    with _LIBRARY_LOCK:
+        if _LIBRARY is None or refresh:
+            library = {}
+            directory = template_dir()
+            if os.path.isdir(directory):
+                for name in sorted(os.listdir(directory)):
+                    if not name.endswith(".json"):
+                        continue
+                    try:
+                        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                            template = json.load(f)
+                        library[template["id"]] = template
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning("Skipping invalid template %s: %s", name, e)
+            _LIBRARY = library
+        return _LIBRARY
+
+
+def get_template(template_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not template_id:
+        return None
+    return load_library().get(template_id)
+
+
+def match(message: str) -> Optional[Dict[str, Any]]:
+    """Closest built template for `message`, or None below TEMPLATE_MIN_SCORE."""
+    if not TEMPLATES_ENABLED:
+        return None
+    library = load_library()
+    best, best_score = None, 0
+    for template_id in library:
+        archetype = _ARCHETYPES_BY_ID.get(template_id)
+        if archetype is None:
+            continue
+        s = score(message, archetype)
+        if s > best_score:
+            best, best_score = library[template_id], s
+    return best if best_score >= TEMPLATE_MIN_SCORE else None
+
+
+# --- Semillas para los agentes ---
+
+def architect_seed(template: Dict[str, Any]) -> str:
+    return (
+        f"BASE TEMPLATE PLAN ({template['id']}): the project is a variation of this archetype. "
+        "Start from these tasks: keep the ones that still apply, adapt their descriptions to the "
+        "specification and add only the tasks needed for what differs.\n"
+        + json.dumps({"tasks": template.get("plan", [])}, ensure_ascii=False)
+    )
+
+
+def constructor_seed(template: Dict[str, Any]) -> str:
+    files = template.get("files", {})
+    parts, budget = [], TEMPLATE_CONTEXT_MAX_CHARS
+    for path, content in files.items():
+        if len(content) <= budget:
+            parts.append(f"### {path}\n{content}")
+            budget -= len(content)
+        else:
+            parts.append(f"### {path}\n(contenido omitido por tamaño)")
+    return (
+        f"## PROYECTO BASE (plantilla {template['id']}):\n"
+        "Estos ficheros son el punto de partida. Devuelve en `file_structure` SOLO los ficheros nuevos o "
+        "los que cambian respecto a la base (contenido completo del fichero), y en `kept_files` la lista de "
+        "rutas de la base que el proyecto necesita tal cual. Los ficheros de la base que no estén en "
+        "ninguna de las dos no se incluirán.\n\n" + "\n\n".join(parts)
+    )
+
+
+def merge_files(template: Dict[str, Any], delta: Dict[str, str], kept: Optional[List[str]] = None) -> Dict[str, str]:
+    """The generated delta plus the template files the Constructor explicitly kept."""
+    base = template.get("files", {})
+    kept_paths = {path for path in kept or [] if isinstance(path, str)}
+    files = {path: content for path, content in base.items() if path in kept_paths and path not in delta}
+    files.update(delta)
+    return files
+
+
+# --- Generación offline ---
+
+def build_template(archetype: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the full graph (without template seeding) on the archetype's canonical prompt."""
+    from langchain_core.messages import HumanMessage
+    from .graph import graph
+
+    start = time.perf_counter()
+    result = graph.invoke({
+        "messages": [HumanMessage(content=archetype["prompt"])],
+        "spec_document": "",
+        "current_plan": [],
+        "code_diffs": [],
+        "retry_count": 0,
+        "build_status": "clean",
+        "request_id": "",
+        "template_id": "",
+    })
+    files = {}
+    for item in result.get("code_diffs", []):
+        if isinstance(item, (tuple, list)):
+            files[item[0]] = item[1]
+        elif isinstance(item, dict):
+            files[item.get("filepath", item.get("file_path", ""))] = item.get("content", item.get("code", ""))
+    return {
+        "id": archetype["id"],
+        "title": archetype["title"],
+        "prompt": archetype["prompt"],
+        "spec": result.get("spec_document", ""),
+        "plan": result.get("current_plan", []),
+        "files": files,
+        "provider": os.getenv("LLM_PROVIDER", "google"),
+        "build_seconds": round(time.perf_counter() - start, 2),
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def build(only: Optional[List[str]] = None, force: bool = False) -> List[str]:
+    """Generate missing (or all, with `force`) templates into TEMPLATE_DIR; returns the ids written."""
+    directory = template_dir()
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for archetype in ARCHETYPES:
+        if only and archetype["id"] not in only:
+            continue
+        path = os.path.join(directory, f"{archetype['id']}.json")
+        if os.path.exists(path) and not force:
+            print(f"= {archetype['id']:<18} already built (use --force to regenerate)")
+            continue
+        try:
+            template = build_template(archetype)
+        except Exception as e:
+            print(f"! {archetype['id']:<18} failed: {e}")
+            continue
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(template, f, ensure_ascii=False, indent=2)
+        written.append(archetype["id"])
+        print(f"+ {archetype['id']:<18} {len(template['plan'])} tasks, {len(template['files'])} files "
+              f"in {template['build_seconds']}s")
+    load_library(refresh=True)
+    return written
+
+
+def main_cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Aegis Forge template library (warm-start specs, plans and files)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_parser = sub.add_parser("build", help="Generate templates with the configured LLM provider")
+    build_parser.add_argument("--only", default="", help="Comma-separated template ids")
+    build_parser.add_argument("--force", action="store_true", help="Regenerate templates that already exist")
+    sub.add_parser("list", help="List archetypes and whether they are built")
+    match_parser = sub.add_parser("match", help="Show the template chosen for a prompt")
+    match_parser.add_argument("prompt")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        only = [i.strip() for i in args.only.split(",") if i.strip()]
+        unknown = [i for i in only if i not in _ARCHETYPES_BY_ID]
+        if unknown:
+            parser.error(f"unknown template id(s): {', '.join(unknown)}")
+        build(only, args.force)
+    elif args.command == "list":
+        library = load_library()
+        print(f"Template dir: {template_dir()}")
+        for archetype in ARCHETYPES:
+            template = library.get(archetype["id"])
+            status = f"{len(template['plan'])} tasks, {len(template['files'])} files" if template else "not built"
+            print(f"{archetype['id']:<18} {archetype['title']:<22} {status}")
+    else:
+        template = match(args.prompt)
+        print(template["id"] if template else "(no template)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,27 @@
+import os
+import sys
+
+# Los tests offline importan el backend como paquete (`backend.*`) y usan el
+# proveedor falso; los agentes instancian su modelo al importarse.
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+os.environ.setdefault("LLM_PROVIDER", "fake")
+
+import pytest
+
+
+@pytest.fixture
+def no_rate_limit():
+    """Disable slowapi limits for the duration of a test."""
+    from backend import main
+    main.limiter.enabled = False
+    yield
+    main.limiter.enabled = True
+
+
+@pytest.fixture
+def client(no_rate_limit):
+    """TestClient for the app, without rate limits and with an empty /chat cache."""
+    from fastapi.testclient import TestClient
+    from backend import main
+    main.CHAT_CACHE.clear()
+    return TestClient(main.app)
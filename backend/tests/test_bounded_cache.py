@@ -0,0 +1,61 @@
+import gc
+
+from backend import bounded_cache
+from backend.bounded_cache import BoundedCache
+
+
+def test_evicts_lru_by_total_bytes():
+    cache = BoundedCache("test_lru", max_bytes=1000, policy="lru", compress_min_bytes=10_000)
+    cache.set("a", "x" * 300)
+    cache.set("b", "y" * 300)
+    cache.get("a")
+    cache.set("c", "z" * 300)
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.stats()["bytes"] <= 1000
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lfu_keeps_frequently_used_entries():
+    cache = BoundedCache("test_lfu", max_bytes=1000, policy="lfu", compress_min_bytes=10_000)
+    cache.set("hot", "x" * 300)
+    for _ in range(3):
+        cache.get("hot")
+    cache.set("cold", "y" * 300)
+    cache.set("new", "z" * 300)
+    assert "hot" in cache and "new" in cache and "cold" not in cache
+
+
+def test_compresses_large_values_and_returns_copies():
+    cache = BoundedCache("test_compress", max_bytes=1_000_000, compress_min_bytes=1024)
+    payload = {"code_generated": [{"filepath": f"src/f{i}.ts", "content": "export {};\n" * 200} for i in range(20)]}
+    cache.set("k" * 500, payload)
+
+    stats = cache.stats()
+    assert stats["compressed_entries"] == 1
+    assert stats["bytes"] < stats["raw_bytes"]
+    result = cache.get("k" * 500)
+    assert result == payload
+    result["code_generated"].clear()
+    assert cache.get("k" * 500) == payload
+
+
+def test_oversized_value_is_not_cached_and_clear_resets_footprint():
+    cache = BoundedCache("test_clear", max_bytes=500, compress_min_bytes=10_000)
+    cache.set("small", "x" * 100)
+    cache.set("huge", "y" * 5000)
+    assert "small" in cache and "huge" not in cache
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()["bytes"] == 0
+    assert "test_clear" in bounded_cache.all_stats()
+
+
+def test_registry_keeps_repeated_names_and_forgets_dropped_caches():
+    first = BoundedCache("test_registry", max_bytes=1000)
+    second = BoundedCache("test_registry", max_bytes=2000)
+    stats = bounded_cache.all_stats()
+    assert stats["test_registry"]["max_bytes"] == 1000
+    assert stats["test_registry#2"]["max_bytes"] == 2000
+
+    del first, second
+    gc.collect()
+    assert not any(name.startswith("test_registry") for name in bounded_cache.all_stats())
@@ -0,0 +1,69 @@
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from backend import agent_architect, agent_visionary, cassette, main, model_config
+from backend.fake_llm import FakeChatModel
+from backend.retry_utils import invoke_with_retry
+
+
+@pytest.fixture(autouse=True)
+def no_cassette():
+    yield
+    cassette.use_cassette(None)
+
+
+def test_record_then_replay_returns_same_responses(tmp_path):
+    path = str(tmp_path / "calls.jsonl.gz")
+    model = FakeChatModel(role="visionary")
+    prompts = [[SystemMessage(content="spec"), HumanMessage(content=f"idea {i}")] for i in range(3)]
+
+    cassette.use_cassette(cassette.Cassette(path, "record"))
+    recorded = [invoke_with_retry(model, msgs).content for msgs in prompts]
+
+    cassette.use_cassette(cassette.Cassette(path, "replay"))
+    # En replay el modelo no se invoca
+    replayed = [invoke_with_retry(None, msgs).content for msgs in prompts]
+    assert replayed == recorded
+
+
+def test_replay_miss_raises(tmp_path):
+    path = str(tmp_path / "calls.jsonl")
+    cassette.use_cassette(cassette.Cassette(path, "record"))
+    cassette.invoke_with_cassette(FakeChatModel(role="refiner"), "prompt grabado")
+
+    cassette.use_cassette(cassette.Cassette(path, "replay"))
+    assert cassette.invoke_with_cassette(None, "prompt grabado").content
+    with pytest.raises(cassette.CassetteMissError):
+        cassette.invoke_with_cassette(None, "otro prompt")
+
+
+def test_failed_calls_are_replayed_as_errors(tmp_path):
+    path = str(tmp_path / "calls.jsonl")
+    cassette.use_cassette(cassette.Cassette(path, "record"))
+    with pytest.raises(Exception, match="429"):
+        cassette.invoke_with_cassette(FakeChatModel(role="refiner", error_rate=1.0), "prompt con cuota agotada")
+
+    cassette.use_cassette(cassette.Cassette(path, "replay"))
+    with pytest.raises(cassette.RecordedCallError, match="FakeProviderError: 429"):
+        cassette.invoke_with_cassette(None, "prompt con cuota agotada")
+
+
+def test_chat_replays_without_provider_credentials(client, tmp_path, monkeypatch):
+    path = str(tmp_path / "chat.jsonl")
+    cassette.use_cassette(cassette.Cassette(path, "record"))
+    recorded = client.post("/chat", json={"message": "App grabada en cassette"})
+    assert recorded.status_code == 200
+
+    # Sin cachés en proceso: en replay todas las llamadas pasan por la cassette
+    for cache in (main.CHAT_CACHE, agent_visionary.VISIONARY_CACHE, agent_architect.ARCHITECT_CACHE):
+        cache.clear()
+    # Gemini sin clave: construir el cliente fallaría con un ValidationError
+    monkeypatch.setattr(model_config, "PROVIDER", "google")
+    monkeypatch.setattr(model_config, "_MODEL_INSTANCES", {})
+    monkeypatch.delenv("GOOGLE_API_KEY", raising=False)
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    cassette.use_cassette(cassette.Cassette(path, "replay"))
+    replayed = client.post("/chat", json={"message": "App grabada en cassette"})
+
+    assert replayed.status_code == 200
+    assert replayed.json()["code_generated"] == recorded.json()["code_generated"]
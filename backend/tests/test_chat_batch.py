@@ -0,0 +1,92 @@
+import json
+import threading
+from collections import Counter
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import batch, chat_pipeline, main
+
+
+def _lines(response):
+    return [json.loads(line) for line in response.text.splitlines() if line.strip()]
+
+
+def test_batch_dedupes_and_streams_per_item_status(client):
+    client.post("/chat", json={"message": "App cacheada"})
+
+    prompts = ["App de tareas", "App cacheada", "  App de tareas ", "", "App de notas"]
+    response = client.post("/chat/batch", json={"prompts": prompts, "max_concurrency": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = _lines(response)
+    summary = lines[-1]["summary"]
+    items = {item["index"]: item for item in lines[:-1]}
+    assert sorted(items) == [0, 1, 2, 3, 4]
+    assert items[1]["status"] == "cached"
+    assert items[3]["status"] == "error" and items[3]["status_code"] == 400
+    assert items[0]["status"] == items[2]["status"] == items[4]["status"] == "ok"
+    assert items[2]["duplicate_of"] == 0
+    assert items[2]["result"] == items[0]["result"]
+    assert summary == {"total": 5, "unique": 3, "ok": 3, "cached": 1, "error": 1}
+    # Los resultados del lote alimentan la caché de /chat
+    assert chat_pipeline.result_id("App de notas") in main.CHAT_CACHE
+
+
+def test_batch_rejects_oversized_lists(client):
+    prompts = [f"App {i}" for i in range(batch.BATCH_MAX_PROMPTS + 1)]
+    assert client.post("/chat/batch", json={"prompts": prompts}).status_code == 400
+    assert client.post("/chat/batch", json={"prompts": []}).status_code == 400
+
+
+def test_cancelled_graph_stops_before_the_next_node():
+    cancelled = threading.Event()
+    cancelled.set()
+    with pytest.raises(chat_pipeline.ChatCancelled):
+        chat_pipeline.run_chat_graph("App cancelada", cancelled=cancelled)
+
+
+def test_each_new_batch_prompt_uses_a_chat_run():
+    main.limiter.reset()
+    main.CHAT_CACHE.clear()
+    client = TestClient(main.app)
+    assert client.post("/chat", json={"message": "App previa"}).status_code == 200
+
+    prompts = [f"App de lote {i}" for i in range(6)] + ["App previa"]
+    lines = _lines(client.post("/chat/batch", json={"prompts": prompts}))
+    statuses = Counter(item.get("status") for item in lines[:-1])
+    # 5/minuto: una ya gastada por /chat, quedan 4 para el lote; la cacheada no cuenta
+    assert statuses == {"ok": 4, "error": 2, "cached": 1}
+    assert {item["status_code"] for item in lines[:-1] if item["status"] == "error"} == {429}
+    main.limiter.reset()
+
+
+def test_batch_concurrency_is_shared_across_batches(monkeypatch):
+    import asyncio
+    import time
+
+    monkeypatch.setattr(batch, "BATCH_CONCURRENCY", 2)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def fake_run(message, request_id="", thread_id=None, cancelled=None):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return {"response": message}
+
+    monkeypatch.setattr(batch, "run_chat_graph", fake_run)
+    main.CHAT_CACHE.clear()
+
+    async def drain(tag):
+        prompts = [f"{tag} {i}" for i in range(4)]
+        return [line async for line in batch.batch_events(prompts, 2, tag, main.token_budget, lambda: True)]
+
+    async def both():
+        return await asyncio.gather(drain("lote-a"), drain("lote-b"))
+
+    asyncio.run(both())
+    assert peak[0] == 2
@@ -0,0 +1,81 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from backend import main
+from backend.fake_llm import FakeChatModel, FakeProviderError
+from backend.benchmarks.run import compare_reports
+
+
+def test_chat_runs_offline_with_fake_provider(client):
+    response = client.post("/chat", json={"message": "Una app de tareas"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["spec_document"].startswith("# Especificación")
+    assert len(body["plan"]) == 5
+    assert len(body["code_generated"]) == 6
+
+
+def test_graph_appends_each_message_once():
+    state = {"messages": [HumanMessage(content="Una app de notas sin duplicados")], "spec_document": "",
+             "current_plan": [], "code_diffs": [], "retry_count": 0, "build_status": "clean"}
+    result = main.graph.invoke(state)
+    # Petición, spec del Visionario y resumen del Constructor (el reducer operator.add concatena)
+    assert [m.type for m in result["messages"]] == ["human", "ai", "ai"]
+
+
+def test_fake_provider_injects_errors():
+    model = FakeChatModel(role="visionary", error_rate=1.0)
+    with pytest.raises(FakeProviderError):
+        model.invoke([HumanMessage(content="hola")])
+
+
+def test_compare_reports_flags_regressions():
+    baseline = {"results": {"a": {"p50_ms": 10.0}, "b": {"p50_ms": 10.0}}}
+    current = {"results": {"a": {"p50_ms": 10.5}, "b": {"p50_ms": 20.0}}}
+    assert compare_reports(baseline, current, threshold=0.15) == ["b"]
+
+
+def test_loadtest_stage_reports_all_endpoints(no_rate_limit):
+    import asyncio
+    import random
+    import httpx
+    from backend.benchmarks.loadtest import PayloadFactory, parse_mix, run_stage
+
+    async def stage():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            rng = random.Random(0)
+            payloads = PayloadFactory(rng, unique_ratio=1.0, export_files=5, export_file_bytes=256, refine_files=2)
+            return await run_stage(client, rate=50, duration=0.2, mix=parse_mix("chat=1,refine=1,export=1"),
+                                   payloads=payloads, rng=rng, poisson=False, max_in_flight=64)
+
+    result = asyncio.run(stage())
+    assert result["sent"] > 0
+    assert result["error_rate"] == 0.0
+    assert set(result["endpoints"]) == {"chat", "refine", "export"}
+    assert result["overall"]["p99_ms"] >= result["overall"]["p50_ms"]
+
+
+def test_refine_runs_off_the_event_loop(no_rate_limit, monkeypatch):
+    import asyncio
+    import time
+    import httpx
+    from backend import refine
+
+    slow = FakeChatModel(role="refiner", latency_ms=300)
+    monkeypatch.setattr(refine, "get_routed_model", lambda role, messages: slow)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            refining = asyncio.create_task(client.post("/refine", json={
+                "instruction": "Añade validación", "current_files": {"src/a.ts": "export {};"}}))
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            health = await client.get("/")
+            return health, time.perf_counter() - start, await refining
+
+    health, health_s, refined = asyncio.run(scenario())
+    assert health.status_code == 200 and health_s < 0.2
+    assert refined.status_code == 200
+    assert refined.json()["modified_files"]
@@ -0,0 +1,68 @@
+import pytest
+from langchain_core.messages import HumanMessage
+
+from backend import agent_architect, fake_llm, model_config
+from backend.bounded_cache import BoundedCache
+from backend.model_config import get_routed_model, route_model
+
+PLAN = '{"tasks": [{"id": "TASK-001", "description": "Crear el modelo de tareas", "status": "pending"}]}'
+
+
+def test_short_spec_goes_to_fast_tier():
+    decision = route_model("architect", [HumanMessage(content="Una app de tareas")])
+    assert decision["tier"] == "fast"
+    # Modelo más pequeño, no menos salida: el max_tokens del rol es el mínimo
+    assert decision["max_tokens"] == model_config.MODEL_PARAMS["architect"]["max_tokens"]
+
+
+def test_google_fast_tier_is_a_smaller_model(monkeypatch):
+    monkeypatch.setattr(model_config, "PROVIDER", "google")
+    decision = route_model("visionary", [HumanMessage(content="Una app de tareas")])
+    assert decision["tier"] == "fast"
+    assert decision["model"] not in (None, model_config.AVAILABLE_MODELS_GOOGLE["visionary"])
+
+
+def test_unparseable_plan_escalates_to_standard_tier(monkeypatch):
+    fake_llm.reset()
+    monkeypatch.setattr(fake_llm, "_RECORDED", {"architect": ['{"tasks": [{"id": "TASK-001", "descr', PLAN]})
+    monkeypatch.setattr(agent_architect, "ARCHITECT_CACHE", BoundedCache("architect-test", 1 << 20))
+
+    result = agent_architect.architect_agent({"spec_document": "# Spec\nUna app de tareas"})
+
+    assert [task["id"] for task in result["current_plan"]] == ["TASK-001"]
+
+
+def test_long_plan_goes_to_large_tier():
+    plan = [{"id": f"TASK-{i}", "description": "x", "status": "pending"} for i in range(30)]
+    decision = route_model("constructor", [HumanMessage(content="spec")], plan=plan)
+    assert decision["tier"] == "large"
+    assert decision["max_tokens"] == 16384
+
+
+def test_routed_models_are_reused():
+    messages = [HumanMessage(content="hola")]
+    assert get_routed_model("visionary", messages) is get_routed_model("visionary", messages)
+
+
+def test_routing_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(model_config, "MODEL_ROUTING_ENABLED", False)
+    decision = route_model("constructor", [HumanMessage(content="spec")])
+    assert decision["tier"] == "default" and decision["model"] is None
+
+
+@pytest.mark.parametrize("provider", ["google", "groq", "fake"])
+def test_routed_max_tokens_never_exceed_model_limit(monkeypatch, provider):
+    monkeypatch.setattr(model_config, "PROVIDER", provider)
+    plan = [{"id": f"TASK-{i}", "description": "x", "status": "pending"} for i in range(60)]
+    for role in model_config.ROUTING_TABLE:
+        for messages in ([HumanMessage(content="x")], [HumanMessage(content="x" * 200_000)]):
+            decision = route_model(role, messages, plan=plan)
+            assert decision["max_tokens"] <= model_config.output_token_limit(role, decision["model"])
+
+
+def test_large_tier_is_capped_for_gemini_1_5(monkeypatch):
+    monkeypatch.setattr(model_config, "PROVIDER", "google")
+    monkeypatch.setitem(model_config.ROUTING_TIERS["large"], "google", "gemini-1.5-flash")
+    plan = [{"id": f"TASK-{i}", "description": "x", "status": "pending"} for i in range(30)]
+    decision = route_model("constructor", [HumanMessage(content="spec")], plan=plan)
+    assert decision["tier"] == "large" and decision["max_tokens"] == 8192
@@ -0,0 +1,67 @@
+import gzip
+import json
+
+from backend import responses
+
+
+def test_chat_is_compressed_and_revalidated_with_etag(client):
+    payload = {"message": "App con ETag"}
+    first = client.post("/chat", json=payload, headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["content-encoding"] in ("gzip", "br")
+    assert first.json()["spec_document"]
+    etag = first.headers["etag"]
+    assert etag.startswith('W/"')
+
+    # POST no es condicional (RFC 9110): siempre devuelve el cuerpo
+    repeated = client.post("/chat", json=payload, headers={"If-None-Match": etag})
+    assert repeated.status_code == 200
+    assert repeated.headers["etag"] == etag
+
+    # La revalidación va por GET sobre Content-Location
+    location = first.headers["content-location"]
+    assert client.get(location).json() == first.json()
+    again = client.get(location, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == etag
+    assert client.get("/chat/results/missing").status_code == 404
+
+
+def test_cache_hits_are_served_from_stored_bytes(client, monkeypatch):
+    payload = {"message": "App servida desde bytes"}
+    first = client.post("/chat", json=payload, headers={"Accept-Encoding": "gzip"})
+
+    def no_encoding(*args, **kwargs):
+        raise AssertionError("a cache hit must not re-encode the payload")
+
+    monkeypatch.setattr(responses, "dumps", no_encoding)
+    monkeypatch.setattr(responses, "content_etag", no_encoding)
+    hit = client.post("/chat", json=payload, headers={"Accept-Encoding": "gzip"})
+    assert hit.headers["etag"] == first.headers["etag"]
+    assert hit.headers["content-encoding"] == "gzip"
+    assert hit.json() == first.json()
+    # Sin gzip aceptado, el cuerpo almacenado se descomprime
+    plain = client.post("/chat", json=payload, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert plain.json() == first.json()
+
+
+def test_cors_exposes_etag_and_request_id(client):
+    response = client.post("/chat", json={"message": "App con CORS"}, headers={"Origin": "http://localhost:3000"})
+    exposed = {h.strip().lower() for h in response.headers["access-control-expose-headers"].split(",")}
+    assert {"etag", "content-location", "x-request-id"} <= exposed
+
+
+def test_choose_encoding_respects_q_values():
+    assert responses.choose_encoding(None) is None
+    assert responses.choose_encoding("identity") is None
+    assert responses.choose_encoding("gzip;q=0.5, deflate") == "gzip"
+    assert responses.choose_encoding("br;q=0, gzip") == "gzip"
+    assert responses.choose_encoding("gzip;q=0") is None
+
+
+def test_compress_and_dumps_round_trip():
+    body = responses.dumps({"files": {"a.ts": "á" * 2000}})
+    assert json.loads(gzip.decompress(responses.compress(body, "gzip"))) == {"files": {"a.ts": "á" * 2000}}
+    assert responses.etag_matches('"nope", ' + responses.content_etag(body), responses.content_etag(body))
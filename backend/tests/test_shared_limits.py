@@ -0,0 +1,114 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from backend import llm_budget, main
+from backend.rate_limits import SharedCounterStorage
+from backend.shared_limits import SQLiteCounterStore, TokenBudget, incr_with_ttl
+
+
+def test_limit_is_shared_between_workers(tmp_path):
+    uri = f"sqlite://{tmp_path / 'limits.db'}"
+    # Dos storages sobre el mismo fichero simulan dos workers de Uvicorn
+    worker_a = FixedWindowRateLimiter(storage_from_string(uri))
+    worker_b = FixedWindowRateLimiter(storage_from_string(uri))
+    assert isinstance(worker_a.storage, SharedCounterStorage)
+
+    limit = parse("5/minute")
+    hits = [worker.hit(limit, "client") for _ in range(3) for worker in (worker_a, worker_b)]
+    assert hits.count(True) == 5
+    assert worker_b.get_window_stats(limit, "client").remaining == 0
+
+
+def test_counter_store_expires_keys(tmp_path):
+    store = SQLiteCounterStore(str(tmp_path / "c.db"))
+    assert store.incrby("k", 3) == 3
+    store.expire("k", -1)
+    assert store.get("k") is None
+    assert store.pttl("k") == -2
+    assert store.incrby("k", 1) == 1
+
+
+def test_first_increment_sets_expiry_atomically(tmp_path):
+    store = SQLiteCounterStore(str(tmp_path / "ttl.db"))
+    assert incr_with_ttl(store, "k", 2, 60) == 2
+    assert 0 < store.pttl("k") <= 60_000
+    # Los incrementos siguientes no alargan la ventana
+    store.expire("k", 5)
+    assert incr_with_ttl(store, "k", 1, 60) == 3
+    assert store.pttl("k") <= 5_000
+
+
+def test_token_budget_rejects_when_window_is_full(tmp_path):
+    path = str(tmp_path / "budget.db")
+    budget_a = TokenBudget(SQLiteCounterStore(path), tokens_per_minute=10_000)
+    budget_b = TokenBudget(SQLiteCounterStore(path), tokens_per_minute=10_000)
+
+    assert budget_a.try_acquire(6_000) == (True, 0.0)
+    admitted, retry_after = budget_b.try_acquire(6_000)
+    assert not admitted and 0 < retry_after <= 60
+    # La reserva rechazada no consume presupuesto
+    assert budget_b.usage()["used"] == 6_000
+    assert budget_b.try_acquire(4_000)[0]
+
+
+def test_token_budget_disabled_by_default():
+    assert TokenBudget(None, tokens_per_minute=0).try_acquire(10**9) == (True, 0.0)
+
+
+def _fixed_window_budget(tokens_per_minute: int) -> TokenBudget:
+    budget = TokenBudget(SQLiteCounterStore(":memory:"), tokens_per_minute=tokens_per_minute)
+    # Una sola ventana: el test no depende del cambio de minuto
+    budget._window = lambda: ("aegis:tokens:test", 60.0)
+    return budget
+
+
+def test_reservation_is_settled_with_real_usage():
+    budget = _fixed_window_budget(100_000)
+    reservation, _ = llm_budget.reserve(20_000, budget)
+    reservation.add_usage({"input_tokens": 900, "output_tokens": 300, "total_tokens": 1_200})
+    assert reservation.settle() == 1_200 and reservation.settle() == 1_200
+    assert budget.usage()["used"] == 1_200
+
+    # Una llamada sin uso informado: la reserva no se reduce
+    reservation, _ = llm_budget.reserve(20_000, budget)
+    reservation.add_usage(None)
+    assert reservation.settle() == 20_000
+    assert budget.usage()["used"] == 21_200
+
+
+def test_chat_charges_the_tokens_the_model_reported(client, monkeypatch):
+    budget = _fixed_window_budget(1_000_000)
+    monkeypatch.setattr(main, "token_budget", budget)
+    reported, record_usage = [], llm_budget.record_usage
+    monkeypatch.setattr(llm_budget, "record_usage", lambda usage: (reported.append(usage), record_usage(usage)))
+
+    assert client.post("/chat", json={"message": "App de gastos"}).status_code == 200
+    assert reported and all(reported)
+    used = budget.usage()["used"]
+    assert used == sum(usage["total_tokens"] for usage in reported)
+    assert used < llm_budget.estimate_request_tokens("App de gastos")
+
+
+def test_rate_limit_check_runs_off_the_event_loop(monkeypatch):
+    main.limiter.reset()
+    main.CHAT_CACHE.clear()
+    check, on_loop = main.limiter._check_request_limit, []
+
+    def spy(*args):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return check(*args)
+
+    monkeypatch.setattr(main.limiter, "_check_request_limit", spy)
+    client = TestClient(main.app)
+    statuses = [client.post("/chat", json={"message": "App limitada"}).status_code for _ in range(6)]
+    assert statuses == [200] * 5 + [429]
+    assert on_loop and not any(on_loop)
+    main.limiter.reset()
@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from backend import speculation, fake_llm
+from backend.retry_utils import InvokeCancelled, cancellable, invoke_with_retry
+
+SPEC_MD = os.path.join(os.path.dirname(__file__), "..", "..", "SPEC.MD")
+
+
+def test_materially_same_accepts_covering_prefixes(monkeypatch):
+    monkeypatch.setattr(speculation, "SPECULATIVE_SIMILARITY", 0.9)
+    monkeypatch.setattr(speculation, "SPECULATIVE_MIN_COVERAGE", 0.7)
+    final = "# Spec\n## Features\n- login\n- dashboard\n- export\n"
+    assert speculation.materially_same(final, final)
+    # Un prefijo largo no se penaliza por ser más corto
+    assert speculation.materially_same(final[:final.rindex("- export")], final)
+    # Un prefijo que cubre poco de la spec final, sí
+    assert not speculation.materially_same(final[:15], final)
+    assert not speculation.materially_same("# Otra cosa completamente distinta aquí\n", final)
+
+
+def test_speculative_pipeline_reuses_plan_and_code(client, monkeypatch):
+    monkeypatch.setattr(speculation, "SPECULATIVE_PIPELINE", True)
+    # La spec sintética del proveedor falso ronda los 900 caracteres: se especula
+    # sobre un prefijo que ya cubre más del 90 %
+    monkeypatch.setattr(speculation, "SPECULATIVE_MIN_CHARS", 800)
+    before = speculation.STATS.snapshot()
+
+    response = client.post("/chat", json={"message": "App especulativa de notas"})
+
+    assert response.status_code == 200
+    assert len(response.json()["code_generated"]) == 6
+    after = speculation.STATS.snapshot()
+    assert after["architect_reused"] == before["architect_reused"] + 1
+    assert after["constructor_reused"] == before["constructor_reused"] + 1
+
+
+def test_long_spec_speculation_is_capped_and_needs_near_complete_prefix(client, monkeypatch):
+    with open(SPEC_MD, encoding="utf-8") as f:
+        spec = f.read()
+    monkeypatch.setattr(speculation, "SPECULATIVE_PIPELINE", True)
+    monkeypatch.setattr(fake_llm, "_RECORDED", {"visionary": [spec]})
+    before = speculation.STATS.snapshot()
+
+    response = client.post("/chat", json={"message": "App especulativa con la spec del repositorio"})
+
+    assert response.status_code == 200
+    after = speculation.STATS.snapshot()
+    started = after["architect_started"] - before["architect_started"]
+    # Como mucho SPECULATIVE_MAX_LAUNCHES lanzamientos, y ninguno cubre la cola de la spec
+    assert 1 < started <= speculation.SPECULATIVE_MAX_LAUNCHES
+    assert after["architect_wasted"] - before["architect_wasted"] == started
+    assert after["architect_reused"] == before["architect_reused"]
+
+
+def test_cancelled_llm_call_stops_mid_stream():
+    # ~2 s de generación: el evento la corta tras el primer fragmento
+    model = fake_llm.FakeChatModel(role="cancel-test", tokens_per_sec=500)
+    messages = [HumanMessage(content="x" * 4000)]
+    event = threading.Event()
+    threading.Timer(0.1, event.set).start()
+
+    started = time.monotonic()
+    with cancellable(event), pytest.raises(InvokeCancelled):
+        invoke_with_retry(model, messages)
+    # Sin reintentos ni esperas de backoff
+    assert time.monotonic() - started < 1
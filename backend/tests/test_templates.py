@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from backend import agent_constructor, fake_llm, templates, threads
+from backend.retry_utils import invoke_with_retry
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setenv("TEMPLATE_DIR", str(tmp_path))
+    assert templates.build(only=["todo-app", "rest-api-auth"]) == ["todo-app", "rest-api-auth"]
+    yield templates.load_library()
+    monkeypatch.delenv("TEMPLATE_DIR")
+    templates.load_library(refresh=True)
+
+
+def test_match_picks_closest_built_template(library):
+    assert set(library) == {"todo-app", "rest-api-auth"}
+    assert templates.match("Quiero una API REST con login JWT")["id"] == "rest-api-auth"
+    assert templates.match("Una app de tareas pendientes")["id"] == "todo-app"
+    # Arquetipo sin construir o sin palabras clave suficientes
+    assert templates.match("Un blog personal") is None
+    assert templates.match("Algo genérico") is None
+
+
+def test_ambiguous_or_weak_keywords_do_not_match(library):
+    # "todo" en español es "all", no una lista de tareas
+    assert templates.match("Una app de recetas con todo incluido") is None
+    # Solo palabras débiles (api, login): no basta para la plantilla de API con auth
+    assert templates.match("Red social para fotógrafos con login y api") is None
+
+
+def test_chat_seeds_constructor_from_template(library, client, monkeypatch):
+    # Respuesta grabada del Constructor: solo el delta más las rutas de la base que conserva
+    delta = {"src/module_2/index.ts": "// cambiado", "src/labels/index.ts": "// nuevo"}
+    reply = json.dumps({"file_structure": delta, "kept_files": ["src/module_1/index.ts"]})
+    monkeypatch.setattr(fake_llm, "_RECORDED", {"constructor": [reply]})
+    prompts = []
+
+    def spy(model, messages):
+        prompts.append("\n".join(str(m.content) for m in messages))
+        return invoke_with_retry(model, messages)
+
+    monkeypatch.setattr(agent_constructor, "invoke_with_retry", spy)
+
+    response = client.post("/chat", json={"message": "Una app de tareas pendientes con etiquetas"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["template_id"] == "todo-app"
+    assert "## PROYECTO BASE (plantilla todo-app)" in prompts[-1]
+    generated = {item["filepath"]: item["content"] for item in body["code_generated"]}
+    base = library["todo-app"]["files"]
+    assert generated == {"src/module_1/index.ts": base["src/module_1/index.ts"], **delta}
+
+
+def test_thread_follow_ups_do_not_switch_template(library, client):
+    threads.THREADS.clear()
+    first = client.post("/chat", json={"message": "Una tienda online con carrito", "thread_id": "tienda"})
+    follow_up = client.post("/chat", json={"message": "Añade una lista de tareas", "thread_id": "tienda"})
+    assert first.json()["template_id"] is None
+    assert follow_up.status_code == 200
+    assert follow_up.json()["template_id"] is None
+
+
+def test_merge_files_keeps_only_listed_template_files():
+    template = {"files": {"a.ts": "a", "b.ts": "b", "unused.ts": "u"}}
+    merged = templates.merge_files(template, {"b.ts": "B", "c.ts": "c"}, ["a.ts", "b.ts", "missing.ts"])
+    assert merged == {"a.ts": "a", "b.ts": "B", "c.ts": "c"}
+    # Respuesta vacía del modelo: no se cuela la plantilla entera
+    assert templates.merge_files(template, {}) == {}
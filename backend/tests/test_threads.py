@@ -0,0 +1,58 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from backend import chat_pipeline, llm_budget, main, threads
+from backend.shared_limits import SQLiteCounterStore, TokenBudget
+from backend.threads import ThreadStore
+
+
+def test_old_turns_are_folded_into_a_rolling_summary(monkeypatch):
+    monkeypatch.setattr(threads, "THREAD_SUMMARY_TRIGGER_MESSAGES", 4)
+    monkeypatch.setattr(threads, "THREAD_KEEP_MESSAGES", 2)
+    store = ThreadStore(SQLiteCounterStore(":memory:"))
+
+    assert store.record_turn("t", [HumanMessage(content="Quiero una app de tareas"), AIMessage(content="Spec 1")]) is None
+    store.record_turn("t", [HumanMessage(content="Añade etiquetas"), AIMessage(content="Spec 2")])
+    pending = store.record_turn("t", [HumanMessage(content="Y modo oscuro"), AIMessage(content="Spec 3")])
+    assert pending is not None
+    pending.result(timeout=10)
+
+    history = store.history("t")
+    assert history[0].content.startswith(threads.SUMMARY_PREFIX)
+    assert [m.content for m in history[1:]] == ["Y modo oscuro", "Spec 3"]
+    assert store.stats()["summaries"] == 1
+
+
+def test_threads_are_shared_between_workers(tmp_path):
+    # Dos workers abren el mismo almacén: el turno siguiente puede llegar a cualquiera
+    path = str(tmp_path / "threads.db")
+    worker_a, worker_b = ThreadStore(SQLiteCounterStore(path)), ThreadStore(SQLiteCounterStore(path))
+    worker_a.record_turn("t", [HumanMessage(content="App de recetas"), AIMessage(content="Spec 1")])
+    worker_b.record_turn("t", [HumanMessage(content="Añade favoritos"), AIMessage(content="Spec 2")])
+    assert [m.content for m in worker_a.history("t")] == ["App de recetas", "Spec 1", "Añade favoritos", "Spec 2"]
+
+
+def test_summarization_is_charged_to_the_token_budget(monkeypatch):
+    monkeypatch.setattr(threads, "THREAD_SUMMARY_TRIGGER_MESSAGES", 1)
+    monkeypatch.setattr(threads, "THREAD_KEEP_MESSAGES", 1)
+    budget = TokenBudget(SQLiteCounterStore(":memory:"), tokens_per_minute=100)
+    assert budget.try_acquire(100) == (True, 0.0)
+    monkeypatch.setattr(llm_budget, "_BUDGET", budget)
+    store = ThreadStore(SQLiteCounterStore(":memory:"))
+
+    pending = store.record_turn("t", [HumanMessage(content="Quiero una app de tareas"), AIMessage(content="Spec 1")])
+    pending.result(timeout=10)
+
+    # Sin presupuesto no se resume, y el hilo queda libre para reintentarlo en el turno siguiente
+    assert store.stats()["budget_denied"] == 1 and store.stats()["summaries"] == 0
+    assert store.record_turn("t", [HumanMessage(content="Añade etiquetas")]) is not None
+
+
+def test_chat_with_thread_id_sends_history_and_skips_cache(client):
+    threads.THREADS.clear()
+    for message in ("App de recetas", "Añade favoritos"):
+        response = client.post("/chat", json={"message": message, "thread_id": "hilo-1"})
+        assert response.status_code == 200
+
+    history = threads.THREADS.history("hilo-1")
+    assert [m.content for m in history if isinstance(m, HumanMessage)] == ["App de recetas", "Añade favoritos"]
+    assert chat_pipeline.result_id("App de recetas") not in main.CHAT_CACHE
@@ -0,0 +1,105 @@
+import sys
+import json
+import pstats
+import threading
+import contextvars
+
+import pytest
+
+from backend import profiling, tracing
+
+
+def _spin(n: int) -> int:
+    return sum(i * i for i in range(n))
+
+
+def test_span_tree_and_otlp_export(tmp_path):
+    request_id, trace = tracing.begin_request("req-tree")
+    assert request_id == "req-tree"
+    with tracing.span("http.request", request_id=request_id) as root:
+        with tracing.span("node.visionary"):
+            tracing.add_event("cache.hit", cache="visionary")
+        try:
+            with tracing.span("node.architect"):
+                raise ValueError("boom")
+        except ValueError:
+            pass
+
+    by_name = {s["name"]: s for s in trace.summary()}
+    assert by_name["node.visionary"]["parent_id"] == root.span_id
+    assert by_name["node.architect"]["parent_id"] == root.span_id
+    assert by_name["node.architect"]["error"] == "ValueError: boom"
+
+    path = tracing.export_trace(trace, str(tmp_path))
+    with open(path, encoding="utf-8") as f:
+        spans = json.load(f)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["name"] for s in spans] == ["http.request", "node.visionary", "node.architect"]
+    assert {s["traceId"] for s in spans} == {trace.trace_id}
+    assert spans[1]["events"][0]["name"] == "cache.hit"
+    assert spans[2]["status"]["code"] == 2
+
+
+def test_client_request_ids_are_validated_and_never_shared():
+    assert tracing.begin_request("../../etc/passwd")[0] != "../../etc/passwd"
+    assert tracing.begin_request("x" * 65)[0] != "x" * 65
+    first, _ = tracing.begin_request("dup-id")
+    second, _ = tracing.begin_request("dup-id")
+    assert first == "dup-id" and second != "dup-id"
+
+
+@pytest.mark.parametrize("kind", ["cprofile", "pyinstrument"])
+def test_profiler_includes_worker_threads(tmp_path, monkeypatch, kind):
+    if kind == "pyinstrument":
+        pytest.importorskip("pyinstrument")
+    else:
+        # Sin pyinstrument instalado se usa cProfile
+        monkeypatch.setitem(sys.modules, "pyinstrument", None)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    profiler = profiling.RequestProfiler("req-profile")
+    assert profiler._kind == kind
+    assert profiler.start()
+    # Un segundo perfil concurrente se omite en lugar de fallar
+    assert not profiling.RequestProfiler("req-other").start()
+
+    def work():
+        with profiling.profile_thread():
+            # Lo bastante largo para que el muestreo de pyinstrument lo capture
+            _spin(1_000_000)
+
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(work,))
+    worker.start()
+    worker.join()
+    path = profiler.stop()
+
+    if kind == "cprofile":
+        functions = {name for _, _, name in pstats.Stats(path).stats}
+    else:
+        with open(path, encoding="utf-8") as f:
+            functions = {frame["name"] for frame in json.load(f)["shared"]["frames"]}
+    assert "_spin" in functions
+    # El bloqueo se libera al terminar
+    other = profiling.RequestProfiler("req-after")
+    assert other.start()
+    other.stop()
+
+
+def test_chat_profile_includes_graph_nodes(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    response = client.post("/chat", json={"message": "App perfilada"}, headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    path = tmp_path / response.headers["x-profile-file"]
+    if path.suffix == ".prof":
+        functions = {name for _, _, name in pstats.Stats(str(path)).stats}
+        assert {"visionary_agent", "architect_agent", "constructor_node"} <= functions
+
+
+def test_streamed_batch_spans_are_exported(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_EXPORT_DIR", str(tmp_path))
+    response = client.post("/chat/batch", json={"prompts": ["App trazada en lote"]})
+    assert response.status_code == 200
+
+    with open(tmp_path / f"trace-{response.headers['x-request-id']}.json", encoding="utf-8") as f:
+        spans = json.load(f)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    # Los nodos corren mientras se envía el cuerpo NDJSON, después del middleware
+    assert {"node.visionary", "node.architect", "node.constructor"} <= {s["name"] for s in spans}
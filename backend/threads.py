@@ -0,0 +1,206 @@
+"""
+Historial por hilo de conversación con resumen incremental en segundo plano.
+
+Las peticiones de /chat con un `thread_id` explícito continúan la
+conversación: el grafo recibe el historial del hilo además del mensaje nuevo.
+Para que el prompt no crezca sin límite, cuando el historial pendiente supera
+THREAD_SUMMARY_TRIGGER_MESSAGES mensajes o THREAD_SUMMARY_TRIGGER_CHARS
+caracteres, un worker en segundo plano (fuera del camino de la petición)
+pliega los turnos antiguos en un resumen acumulado usando el modelo del rol
+`visionary` (tier rápido del router). Los turnos siguientes envían solo:
+
+    [resumen] + últimos THREAD_KEEP_MESSAGES mensajes + mensaje nuevo
+
+El resumen se envía como HumanMessage con un prefijo fijo: varios
+proveedores solo aceptan un SystemMessage al inicio, y los agentes ya ponen
+el suyo.
+
+Los hilos viven en el almacén compartido de shared_limits (SQLite en el host o
+Redis), no en memoria del worker: un turno puede llegar a cualquier worker de
+Uvicorn. Cada hilo es un valor JSON que se actualiza con una lectura-escritura
+atómica; un plazo (`summarizing_until`) evita que dos workers resuman el mismo
+hilo a la vez. El resumen reserva sus tokens en el presupuesto global
+(`llm_budget.budget()`), corregida después con el uso real; si no caben, se
+reintenta en el turno siguiente.
+
+Variables de entorno:
+- THREAD_STORAGE_URI             por defecto RATE_LIMIT_STORAGE_URI (ver shared_limits.py)
+- THREAD_TTL_S=604800            un hilo sin turnos nuevos caduca a los 7 días
+- THREAD_SUMMARY_TRIGGER_MESSAGES=8
+- THREAD_SUMMARY_TRIGGER_CHARS=24000
+- THREAD_KEEP_MESSAGES=4
+- THREAD_SUMMARY_MAX_CHARS=4000  tamaño orientativo del resumen
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, messages_from_dict, messages_to_dict
+
+from . import llm_budget
+from . import shared_limits
+from . import tracing
+from .model_config import get_routed_model
+from .retry_utils import invoke_with_retry
+
+logger = logging.getLogger(__name__)
+
+THREAD_TTL_S = int(os.getenv("THREAD_TTL_S", str(7 * 24 * 3600)))
+THREAD_SUMMARY_TRIGGER_MESSAGES = int(os.getenv("THREAD_SUMMARY_TRIGGER_MESSAGES", "8"))
+THREAD_SUMMARY_TRIGGER_CHARS = int(os.getenv("THREAD_SUMMARY_TRIGGER_CHARS", "24000"))
+THREAD_KEEP_MESSAGES = int(os.getenv("THREAD_KEEP_MESSAGES", "4"))
+THREAD_SUMMARY_MAX_CHARS = int(os.getenv("THREAD_SUMMARY_MAX_CHARS", "4000"))
+
+# Plazo máximo de un resumen en curso: si el worker muere, otro lo retoma
+SUMMARY_LEASE_S = 300
+
+SUMMARY_PREFIX = "Resumen de la conversación anterior:\n"
+
+SUMMARIZER_SYSTEM_PROMPT = f"""
+You maintain the rolling summary of a product-design conversation for Aegis Forge.
+Merge the previous summary (if any) with the new turns into one updated summary.
+Keep every decision, requirement, constraint, chosen stack and open question; drop pleasantries,
+generated code and repetition. Write in the language of the conversation, as compact Markdown
+bullets, at most {THREAD_SUMMARY_MAX_CHARS} characters. Output only the summary.
+"""
+
+
+def _content(message: BaseMessage) -> str:
+    content = message.content
+    return content if isinstance(content, str) else "\n".join(str(part) for part in content)
+
+
+def _load(value: Optional[str]) -> Dict[str, Any]:
+    thread = json.loads(value) if value else {}
+    thread.setdefault("summary", "")
+    thread.setdefault("messages", [])
+    thread.setdefault("summarized_messages", 0)
+    thread.setdefault("summarizing_until", 0)
+    return thread
+
+
+def _needs_summary(messages: List[Dict[str, Any]]) -> bool:
+    return (
+        len(messages) > THREAD_SUMMARY_TRIGGER_MESSAGES
+        or sum(len(str(m["data"].get("content", ""))) for m in messages) > THREAD_SUMMARY_TRIGGER_CHARS
+    )
+
+
+class ThreadStore:
+    """Conversation threads in the shared store, with background summarization of old turns."""
+
+    def __init__(self, client: Any = None, key_prefix: str = "aegis:thread:", workers: int = 2):
+        self.client = client if client is not None else shared_limits.counter_client_from_uri(
+            os.getenv("THREAD_STORAGE_URI") or shared_limits.storage_uri()
+        )
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aegis-summarizer")
+        # Contadores de este worker
+        self.summaries = 0
+        self.failures = 0
+        self.budget_denied = 0
+        self.pending = 0
+
+    def _update(self, thread_id: str, fn) -> None:
+        def apply(value: Optional[str]) -> str:
+            thread = _load(value)
+            fn(thread)
+            return json.dumps(thread, ensure_ascii=False)
+        shared_limits.update_value(self.client, self.key_prefix + thread_id, apply, THREAD_TTL_S)
+
+    def history(self, thread_id: str) -> List[BaseMessage]:
+        """Messages to prepend to a new turn: rolling summary plus the unsummarized tail."""
+        thread = _load(self.client.get(self.key_prefix + thread_id))
+        prefix = [HumanMessage(content=SUMMARY_PREFIX + thread["summary"])] if thread["summary"] else []
+        return prefix + messages_from_dict(thread["messages"])
+
+    def record_turn(self, thread_id: str, messages: List[BaseMessage]) -> Optional[Future]:
+        """Append a finished turn and schedule summarization if the tail grew too large."""
+        job: Dict[str, Any] = {}
+
+        def append(thread: Dict[str, Any]):
+            job.clear()
+            thread["messages"].extend(messages_to_dict(messages))
+            now = time.time()
+            if thread["summarizing_until"] > now or not _needs_summary(thread["messages"]):
+                return
+            # Se pliega todo salvo los últimos THREAD_KEEP_MESSAGES mensajes
+            fold = thread["messages"][:max(0, len(thread["messages"]) - THREAD_KEEP_MESSAGES)]
+            if fold:
+                thread["summarizing_until"] = now + SUMMARY_LEASE_S
+                job.update(previous=thread["summary"], fold=fold)
+
+        self._update(thread_id, append)
+        if not job:
+            return None
+        with self._lock:
+            self.pending += 1
+        ctx = contextvars.copy_context()
+        return self._executor.submit(ctx.run, self._summarize, thread_id, job["previous"], job["fold"])
+
+    def _summarize(self, thread_id: str, previous: str, fold: List[Dict[str, Any]]) -> str:
+        fold_messages = messages_from_dict(fold)
+        transcript = "\n\n".join(f"[{m.type}]\n{_content(m)}" for m in fold_messages)
+        prompt = [
+            SystemMessage(content=SUMMARIZER_SYSTEM_PROMPT),
+            HumanMessage(content=f"## Previous summary\n{previous or '(none)'}\n\n## New turns\n{transcript}"),
+        ]
+        summary = None
+        try:
+            # Entrada del prompt (~4 caracteres/token) más el resumen como salida
+            tokens = sum(len(_content(m)) for m in prompt) // 4 + THREAD_SUMMARY_MAX_CHARS // 4
+            reservation, _ = llm_budget.reserve(tokens)
+            if reservation is None:
+                with self._lock:
+                    self.budget_denied += 1
+                tracing.add_event("thread.summarize.budget_denied", thread_id=thread_id)
+            else:
+                with tracing.span("thread.summarize", thread_id=thread_id, folded_messages=len(fold)):
+                    llm = get_routed_model("visionary", prompt)
+                    summary = _content(llm_budget.run_charged(reservation, invoke_with_retry, llm, prompt)).strip()
+        except Exception as e:
+            logger.warning("Summarization of thread %s failed: %s", thread_id, e)
+            with self._lock:
+                self.failures += 1
+
+        applied = []
+
+        def apply(thread: Dict[str, Any]):
+            applied.clear()
+            thread["summarizing_until"] = 0
+            # Los turnos llegados mientras se resumía quedan detrás de `fold`
+            if summary is not None and thread["messages"][:len(fold)] == fold:
+                thread["messages"] = thread["messages"][len(fold):]
+                thread["summary"] = summary
+                thread["summarized_messages"] += len(fold)
+                applied.append(True)
+
+        try:
+            self._update(thread_id, apply)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.summaries += len(applied)
+        return summary if summary is not None else previous
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "summaries": self.summaries,
+                "failures": self.failures,
+                "budget_denied": self.budget_denied,
+                "pending": self.pending,
+            }
+
+    def clear(self):
+        shared_limits.delete_prefix(self.client, self.key_prefix)
+
+
+THREADS = ThreadStore()
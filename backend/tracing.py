@@ -0,0 +1,284 @@
+"""
+Trazas por petición (span tree).
+
+Cada petición HTTP abre una traza identificada por su `request_id`. Dentro de
+ella se anidan spans para el middleware, cada nodo del grafo, cada intento de
+llamada al modelo (incluidas las esperas de backoff de tenacity) y el parseo
+de las respuestas. Cuando la respuesta termina de enviarse (incluido el cuerpo
+en streaming), la traza puede exportarse como JSON compatible con OTLP
+(`resourceSpans`) para abrirla en Jaeger/Tempo/Perfetto.
+
+Variables de entorno:
+- TRACING_ENABLED="1" | "0"       (por defecto "1")
+- TRACE_EXPORT_DIR=/ruta           (si se define, se escribe un fichero por traza)
+
+El perfilado de CPU bajo demanda (`X-Profile: 1`) está en profiling.py.
+"""
+
+import os
+import asyncio
+import re
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+TRACE_EXPORT_DIR = os.getenv("TRACE_EXPORT_DIR", "")
+SERVICE_NAME = "aegis-forge-backend"
+
+# Trazas abiertas + las últimas cerradas (para consultarlas tras la respuesta)
+RECENT_TRACES_SIZE = 50
+
+# X-Request-ID aceptado del cliente: se usa como clave y en nombres de fichero
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class Span:
+    """A timed unit of work inside a trace."""
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else ""
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes)
+        self.events: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({"name": name, "time_ns": time.time_ns(), "attributes": attributes})
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+
+class Trace:
+    """All spans recorded for a single request."""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def new_span(self, name: str, parent: Optional[Span], attributes: Dict[str, Any]) -> Span:
+        span = Span(self, name, parent, attributes)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    @property
+    def root(self) -> Optional[Span]:
+        return self.spans[0] if self.spans else None
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Serialize the trace using the OTLP/JSON `resourceSpans` layout."""
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attr("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "aegis.tracing"},
+                    "spans": [_otlp_span(self, s) for s in list(self.spans)],
+                }],
+            }]
+        }
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Flat list of (name, parent, duration) useful for logs and debugging."""
+        return [
+            {"name": s.name, "span_id": s.span_id, "parent_id": s.parent_id,
+             "duration_ms": round(s.duration_ms, 2), "error": s.error}
+            for s in list(self.spans)
+        ]
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attr(key: str, value: Any) -> Dict[str, Any]:
+    return {"key": key, "value": _otlp_value(value)}
+
+
+def _otlp_span(trace: Trace, span: Span) -> Dict[str, Any]:
+    return {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+        "attributes": [_otlp_attr(k, v) for k, v in span.attributes.items()]
+                      + [_otlp_attr("aegis.request_id", trace.request_id)],
+        "events": [
+            {"name": e["name"], "timeUnixNano": str(e["time_ns"]),
+             "attributes": [_otlp_attr(k, v) for k, v in e["attributes"].items()]}
+            for e in span.events
+        ],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+    }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("aegis_current_span", default=None)
+_TRACES: "OrderedDict[str, Trace]" = OrderedDict()
+_TRACES_LOCK = threading.Lock()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _register(trace: Trace):
+    _TRACES[trace.request_id] = trace
+    while len(_TRACES) > RECENT_TRACES_SIZE:
+        _TRACES.popitem(last=False)
+
+
+def start_trace(request_id: str) -> Optional[Trace]:
+    if not TRACING_ENABLED:
+        return None
+    trace = Trace(request_id)
+    with _TRACES_LOCK:
+        _register(trace)
+    return trace
+
+
+def begin_request(header_value: Optional[str]) -> Tuple[str, Optional[Trace]]:
+    """
+    Request id and trace for an incoming request.
+
+    A client-supplied `X-Request-ID` is kept only if it is a safe token
+    (`[A-Za-z0-9_-]{1,64}`) and no other trace is using it; otherwise a new id
+    is generated, so traces never overwrite each other.
+    """
+    candidate = header_value if header_value and _REQUEST_ID_RE.match(header_value) else None
+    if not TRACING_ENABLED:
+        return candidate or new_request_id(), None
+    with _TRACES_LOCK:
+        request_id = candidate if candidate and candidate not in _TRACES else new_request_id()
+        trace = Trace(request_id)
+        _register(trace)
+    return request_id, trace
+
+
+def get_trace(request_id: Optional[str]) -> Optional[Trace]:
+    if not request_id:
+        return None
+    with _TRACES_LOCK:
+        return _TRACES.get(request_id)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_request_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace.request_id if span else None
+
+
+@contextmanager
+def span(name: str, request_id: Optional[str] = None, **attributes):
+    """
+    Open a child span of the current one.
+
+    The parent is taken from the context; when there is none (e.g. a graph node
+    running in a worker thread) the `request_id` carried in `ProjectState`
+    is used to find the request's trace. Without either, this is a no-op.
+    """
+    parent = _current_span.get()
+    trace = parent.trace if parent else get_trace(request_id)
+    if trace is None:
+        yield None
+        return
+
+    if parent is None:
+        parent = trace.root
+    s = trace.new_span(name, parent, attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end()
+        _current_span.reset(token)
+
+
+def traced_node(name: str, node):
+    """Wrap a LangGraph node so that each execution is a span of its request."""
+    @functools.wraps(node)
+    def wrapper(state):
+        with span(f"node.{name}", request_id=state.get("request_id")):
+            return node(state)
+    return wrapper
+
+
+def add_event(name: str, **attributes):
+    """Attach an event to the current span, if any."""
+    s = _current_span.get()
+    if s is not None:
+        s.add_event(name, **attributes)
+
+
+def export_trace(trace: Trace, directory: str = "") -> Optional[str]:
+    """Write the trace as OTLP/JSON to `directory` (default TRACE_EXPORT_DIR)."""
+    directory = directory or TRACE_EXPORT_DIR
+    if not directory:
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"trace-{trace.request_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace.to_otlp(), f)
+        return path
+    except OSError as e:
+        logger.warning("Trace export failed for %s: %s", trace.request_id, e)
+        return None
+
+
+
+def export_when_sent(response: Any, trace: Trace):
+    """
+    Export `trace` once `response` has been sent.
+
+    Streaming bodies keep producing spans after the middleware returns, so the
+    export runs as the response's background task, after the last chunk.
+    """
+    from starlette.background import BackgroundTask
+    previous = response.background
+
+    async def export():
+        if previous is not None:
+            await previous()
+        await asyncio.to_thread(export_trace, trace)
+
+    response.background = BackgroundTask(export)